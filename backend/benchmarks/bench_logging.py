@@ -0,0 +1,155 @@
+"""Error-path latency of StripeService during a simulated Stripe outage.
+
+Every call to ``create_payment_intent`` fails with a connection error and
+logs it, which is what happens to /api/payments/create-intent while Stripe
+is down. Compares the previous synchronous ``basicConfig`` handler with the
+queue-based pipeline from ``logging_config``, writing to a regular file and
+to a slow sink that stands in for a blocked stdout pipe.
+
+Run with::
+
+    cd backend
+    pytest benchmarks/bench_logging.py --benchmark-group-by=param:sink
+"""
+import asyncio
+import io
+import logging
+import queue
+import time
+from logging.handlers import QueueListener
+
+import pytest
+import stripe
+
+from logging_config import (
+    ErrorSamplingFilter, JsonFormatter, LazyQueueHandler, RequestContextFilter
+)
+from services.stripe_service import StripeService
+
+SYNC_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class SlowStream(io.TextIOBase):
+    """File-like object whose writes block, like a full stdout pipe"""
+
+    def __init__(self, delay: float = 0.0005):
+        self.delay = delay
+
+    def write(self, data):
+        time.sleep(self.delay)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def open_sink(kind, tmp_path):
+    if kind == "slow":
+        return SlowStream()
+    return open(tmp_path / "app.log", "a", encoding="utf-8")
+
+
+@pytest.fixture
+def stripe_outage(monkeypatch):
+    def fail(*args, **kwargs):
+        raise stripe.error.APIConnectionError("Could not connect to Stripe")
+
+    monkeypatch.setattr(stripe.PaymentIntent, "create", fail)
+    # Keep the circuit breaker closed so every call takes the logging path
+    monkeypatch.setenv("STRIPE_BREAKER_MIN_CALLS", str(10 ** 9))
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    for handler in saved_handlers:
+        root.removeHandler(handler)
+    root.setLevel(logging.INFO)
+    yield root
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in saved_handlers:
+        root.addHandler(handler)
+    root.setLevel(saved_level)
+
+
+def run_failing_call(benchmark, service):
+    loop = asyncio.new_event_loop()
+
+    def call():
+        return loop.run_until_complete(
+            service.create_payment_intent(19.99, "order-123", "lector@example.com")
+        )
+
+    try:
+        result = benchmark(call)
+    finally:
+        loop.close()
+    assert result["success"] is False
+
+
+@pytest.mark.parametrize("sink", ["file", "slow"])
+@pytest.mark.benchmark(group="stripe-outage-error-path")
+def test_error_path_sync_handler(benchmark, stripe_outage, root_logger, tmp_path, sink):
+    stream = open_sink(sink, tmp_path)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(SYNC_FORMAT))
+    root_logger.addHandler(handler)
+
+    run_failing_call(benchmark, StripeService())
+
+
+@pytest.mark.parametrize("sink", ["file", "slow"])
+@pytest.mark.benchmark(group="stripe-outage-error-path")
+def test_error_path_queue_handler(benchmark, stripe_outage, root_logger, tmp_path, sink):
+    stream = open_sink(sink, tmp_path)
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=10000)
+    handler = LazyQueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+    root_logger.addHandler(handler)
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    try:
+        run_failing_call(benchmark, StripeService())
+    finally:
+        listener.stop()
+
+
+@pytest.mark.parametrize("sink", ["file", "slow"])
+@pytest.mark.benchmark(group="stripe-outage-error-path")
+def test_error_path_queue_handler_sampled(benchmark, stripe_outage, root_logger, tmp_path, sink):
+    stream = open_sink(sink, tmp_path)
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=10000)
+    handler = LazyQueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(ErrorSamplingFilter(burst=10, window=60.0))
+    root_logger.addHandler(handler)
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    try:
+        run_failing_call(benchmark, StripeService())
+    finally:
+        listener.stop()
+
+
+@pytest.mark.benchmark(group="suppressed-level")
+def test_suppressed_debug_fstring(benchmark, root_logger):
+    logger = logging.getLogger("bench.suppressed")
+    payload = {"orderId": "order-123", "items": list(range(50))}
+    benchmark(lambda: logger.debug(f"Order payload: {payload}"))
+
+
+@pytest.mark.benchmark(group="suppressed-level")
+def test_suppressed_debug_lazy(benchmark, root_logger):
+    logger = logging.getLogger("bench.suppressed")
+    payload = {"orderId": "order-123", "items": list(range(50))}
+    benchmark(lambda: logger.debug("Order payload: %s", payload))
@@ -0,0 +1,246 @@
+"""Micro-benchmarks for model construction and serialization.
+
+Every request that touches the catalog or an order turns raw MongoDB
+documents into ``Book``/``Order`` instances and back into JSON, so these
+are the hot paths to watch when changing ``models.py``.
+
+Run with::
+
+    cd backend
+    pytest benchmarks/bench_models.py --benchmark-group-by=group
+
+Save a baseline with ``--benchmark-autosave`` and gate a change with
+``--benchmark-compare --benchmark-compare-fail=mean:10%``.
+"""
+import json
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import pytest
+from bson import ObjectId
+
+from models import Book, BookCategory, Order
+
+ORDER_SIZES = [1, 5, 20, 50]
+
+
+def make_book_doc() -> dict:
+    return {
+        "_id": str(ObjectId()),
+        "title": "El Poder de la Mentalidad Positiva",
+        "author": "María Fernández",
+        "price": 19.99,
+        "originalPrice": 24.99,
+        "rating": 4.8,
+        "reviewCount": 156,
+        "cover": "https://images.unsplash.com/photo-1544947950-fa07a98d237f?auto=format&fit=crop&w=687&q=80",
+        "description": "Descubre cómo transformar tu vida a través del poder de los pensamientos positivos.",
+        "category": "Desarrollo Personal",
+        "pages": 256,
+        "bestseller": True,
+        "fileUrl": "https://example.com/books/mentalidad-positiva.pdf",
+        "createdAt": datetime(2024, 1, 1),
+        "updatedAt": datetime(2024, 1, 1),
+    }
+
+
+def make_order_doc(n_items: int, delivered: bool = True) -> dict:
+    now = datetime(2024, 1, 1)
+    items = [
+        {
+            "bookId": str(ObjectId()),
+            "quantity": 1,
+            "price": 19.99,
+            "title": f"Libro {i}",
+        }
+        for i in range(n_items)
+    ]
+    links = [
+        {
+            "bookId": item["bookId"],
+            "bookTitle": item["title"],
+            "downloadUrl": f"/api/download/{uuid.uuid4().hex}",
+            "expiresAt": now + timedelta(hours=48),
+        }
+        for item in items
+    ] if delivered else []
+    return {
+        "_id": str(ObjectId()),
+        "orderId": str(uuid.uuid4()),
+        "items": items,
+        "customer": {
+            "email": "lector@example.com",
+            "firstName": "Ana",
+            "lastName": "García",
+            "country": "ES",
+        },
+        "paymentInfo": {
+            "paymentIntentId": "pi_123",
+            "amount": round(19.99 * n_items, 2),
+            "status": "completed",
+            "paymentMethod": None,
+        },
+        "downloadLinks": links,
+        "status": "delivered" if delivered else "pending",
+        "createdAt": now,
+        "updatedAt": now,
+    }
+
+
+# Alternative representation: plain dataclasses with no validation.
+@dataclass(slots=True)
+class BookDC:
+    title: str
+    price: float
+    originalPrice: float
+    description: str
+    category: BookCategory
+    cover: str
+    pages: int
+    _id: Optional[str] = None
+    author: str = "María Fernández"
+    rating: float = 4.8
+    reviewCount: int = 0
+    bestseller: bool = False
+    fileUrl: Optional[str] = None
+    createdAt: datetime = field(default_factory=datetime.utcnow)
+    updatedAt: datetime = field(default_factory=datetime.utcnow)
+
+
+@dataclass(slots=True)
+class OrderDC:
+    _id: Optional[str]
+    orderId: str
+    items: List[dict]
+    customer: dict
+    paymentInfo: dict
+    downloadLinks: List[dict]
+    status: str
+    createdAt: datetime
+    updatedAt: datetime
+
+
+def book_dc_from_doc(doc: dict) -> BookDC:
+    data = dict(doc)
+    data["category"] = BookCategory(data["category"])
+    return BookDC(**data)
+
+
+# ---------------------------------------------------------------- Book
+
+@pytest.mark.benchmark(group="book-construct")
+def test_book_construct_validated(benchmark):
+    doc = make_book_doc()
+    benchmark(lambda: Book(**doc))
+
+
+@pytest.mark.benchmark(group="book-construct")
+def test_book_construct_model_validate(benchmark):
+    doc = make_book_doc()
+    benchmark(Book.model_validate, doc)
+
+
+@pytest.mark.benchmark(group="book-construct")
+def test_book_construct_defaults(benchmark):
+    # Exercises the datetime.utcnow default factories and enum coercion.
+    doc = make_book_doc()
+    for key in ("_id", "createdAt", "updatedAt", "rating", "reviewCount"):
+        doc.pop(key)
+    benchmark(lambda: Book(**doc))
+
+
+@pytest.mark.benchmark(group="book-construct")
+def test_book_construct_unvalidated(benchmark):
+    doc = make_book_doc()
+    benchmark(lambda: Book.model_construct(**doc))
+
+
+@pytest.mark.benchmark(group="book-construct")
+def test_book_construct_dataclass(benchmark):
+    doc = make_book_doc()
+    benchmark(book_dc_from_doc, doc)
+
+
+@pytest.mark.benchmark(group="book-serialize")
+def test_book_model_dump(benchmark):
+    book = Book(**make_book_doc())
+    benchmark(book.model_dump)
+
+
+@pytest.mark.benchmark(group="book-serialize")
+def test_book_model_dump_json(benchmark):
+    book = Book(**make_book_doc())
+    benchmark(book.model_dump_json)
+
+
+@pytest.mark.benchmark(group="book-serialize")
+def test_book_dataclass_json(benchmark):
+    book = book_dc_from_doc(make_book_doc())
+    benchmark(lambda: json.dumps(asdict(book), default=str))
+
+
+@pytest.mark.benchmark(group="book-serialize")
+def test_book_dict_json(benchmark):
+    doc = make_book_doc()
+    benchmark(lambda: json.dumps(doc, default=str))
+
+
+@pytest.mark.benchmark(group="book-list")
+def test_book_list_construct(benchmark):
+    # Shape of get_all_books: one validation per document in the catalog.
+    docs = [make_book_doc() for _ in range(100)]
+    benchmark(lambda: [Book(**doc) for doc in docs])
+
+
+# ---------------------------------------------------------------- Order
+
+@pytest.mark.parametrize("n_items", ORDER_SIZES)
+@pytest.mark.benchmark(group="order-construct")
+def test_order_construct_validated(benchmark, n_items):
+    doc = make_order_doc(n_items)
+    benchmark(lambda: Order(**doc))
+
+
+@pytest.mark.parametrize("n_items", ORDER_SIZES)
+@pytest.mark.benchmark(group="order-construct")
+def test_order_construct_unvalidated(benchmark, n_items):
+    doc = make_order_doc(n_items)
+    benchmark(lambda: Order.model_construct(**doc))
+
+
+@pytest.mark.parametrize("n_items", ORDER_SIZES)
+@pytest.mark.benchmark(group="order-construct")
+def test_order_construct_dataclass(benchmark, n_items):
+    doc = make_order_doc(n_items)
+    benchmark(lambda: OrderDC(**doc))
+
+
+@pytest.mark.parametrize("n_items", ORDER_SIZES)
+@pytest.mark.benchmark(group="order-serialize")
+def test_order_model_dump(benchmark, n_items):
+    order = Order(**make_order_doc(n_items))
+    benchmark(order.model_dump)
+
+
+@pytest.mark.parametrize("n_items", ORDER_SIZES)
+@pytest.mark.benchmark(group="order-serialize")
+def test_order_model_dump_json(benchmark, n_items):
+    order = Order(**make_order_doc(n_items))
+    benchmark(order.model_dump_json)
+
+
+@pytest.mark.parametrize("n_items", ORDER_SIZES)
+@pytest.mark.benchmark(group="order-serialize")
+def test_order_dict_json(benchmark, n_items):
+    doc = make_order_doc(n_items)
+    benchmark(lambda: json.dumps(doc, default=str))
+
+
+@pytest.mark.parametrize("n_items", ORDER_SIZES)
+@pytest.mark.benchmark(group="order-roundtrip")
+def test_order_roundtrip(benchmark, n_items):
+    # Document -> Order -> JSON, as done by GET /api/orders/{order_id}.
+    doc = make_order_doc(n_items)
+    benchmark(lambda: Order(**doc).model_dump_json())
@@ -0,0 +1,166 @@
+"""Administrative commands.
+
+Run from the backend directory, e.g.::
+
+    python cli.py export-orders --start 2024-01-01 --end 2024-02-01 --format parquet --output orders.parquet
+    python cli.py import-books catalog.jsonl
+    python cli.py build-recommendations
+    python cli.py reconcile-payments --start 2024-01-01
+    python cli.py backfill-entitlements
+"""
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import typer
+from dotenv import load_dotenv
+
+from database import connect_to_mongo, close_mongo_connection
+from events import bus
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+app = typer.Typer(help="Ebooks API administrative commands")
+
+
+async def _export_orders(start: datetime, end: Optional[datetime], format: str, output: Path) -> int:
+    from services.export_service import OrderExportService
+
+    await connect_to_mongo(initialize=False)
+    try:
+        service = OrderExportService()
+        stream = service.stream_parquet(start, end) if format == "parquet" else service.stream_csv(start, end)
+        written = 0
+        with open(output, "wb") as out:
+            async for chunk in stream:
+                out.write(chunk)
+                written += len(chunk)
+        return written
+    finally:
+        await close_mongo_connection()
+
+
+@app.command("export-orders")
+def export_orders(
+    start: datetime = typer.Option(..., help="Include orders created at or after this date"),
+    end: Optional[datetime] = typer.Option(None, help="Include orders created before this date"),
+    format: str = typer.Option("csv", help="csv or parquet"),
+    output: Path = typer.Option(..., help="Destination file"),
+):
+    """Export orders (one row per item) to CSV or Parquet"""
+    if format not in ("csv", "parquet"):
+        raise typer.BadParameter("format must be 'csv' or 'parquet'")
+
+    written = asyncio.run(_export_orders(start, end, format, output))
+    typer.echo(f"Wrote {written} bytes to {output}")
+
+
+async def _import_books(path: Path, format: str, batch_size: int) -> dict:
+    from services.catalog_import_service import CatalogImportService
+
+    await connect_to_mongo(initialize=False)
+    try:
+        service = CatalogImportService(batch_size=batch_size)
+        await service.ensure_indexes()
+        with open(path, encoding="utf-8-sig", newline="") as stream:
+            return await service.import_file(stream, format)
+    finally:
+        await close_mongo_connection()
+
+
+@app.command("import-books")
+def import_books(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help="JSONL or CSV file"),
+    format: Optional[str] = typer.Option(None, help="jsonl or csv (default: from the file extension)"),
+    batch_size: int = typer.Option(1000, help="Rows validated and written per batch"),
+):
+    """Upsert books by ISBN (or title) from a JSONL or CSV file"""
+    format = format or ("csv" if path.suffix.lower() == ".csv" else "jsonl")
+    if format not in ("jsonl", "csv"):
+        raise typer.BadParameter("format must be 'jsonl' or 'csv'")
+
+    report = asyncio.run(_import_books(path, format, batch_size))
+    typer.echo(
+        f"Processed {report['processed']} rows: {report['inserted']} inserted, "
+        f"{report['updated']} updated, {report['failed']} failed"
+    )
+    for error in report["errors"]:
+        typer.echo(f"  row {error['row']}: {error['error']}", err=True)
+    if report["failed"]:
+        raise typer.Exit(code=1)
+
+
+async def _build_recommendations() -> int:
+    from services.book_service import BookService
+    from services.recommendation_service import RecommendationService
+
+    await connect_to_mongo(initialize=False)
+    try:
+        return await RecommendationService(BookService()).rebuild()
+    finally:
+        await close_mongo_connection()
+
+
+@app.command("build-recommendations")
+def build_recommendations():
+    """Recompute "customers also bought" lists from all delivered orders"""
+    books = asyncio.run(_build_recommendations())
+    typer.echo(f"Updated recommendations for {books} books")
+
+
+async def _reconcile_payments(start: datetime, end: Optional[datetime]) -> dict:
+    from services.book_service import BookService
+    from services.order_service import OrderService
+    from services.stripe_service import StripeService
+    from services.entitlement_service import EntitlementService
+    from services.recommendation_service import RecommendationService
+    from services.reconciliation_service import ReconciliationService
+
+    await connect_to_mongo(initialize=False)
+    try:
+        # Subscribe to ORDER_DELIVERED as the API process does
+        EntitlementService()
+        RecommendationService(BookService())
+        service = ReconciliationService(StripeService(), OrderService())
+        return await service.reconcile(start, end)
+    finally:
+        await bus.drain()
+        await close_mongo_connection()
+
+
+@app.command("reconcile-payments")
+def reconcile_payments(
+    start: datetime = typer.Option(..., help="Reconcile pending orders created at or after this date"),
+    end: Optional[datetime] = typer.Option(None, help="Reconcile pending orders created before this date"),
+):
+    """Settle or fail pending orders from Stripe's PaymentIntents (set STRIPE_API_BASE for stripe-mock)"""
+    report = asyncio.run(_reconcile_payments(start, end))
+    for name, value in report.items():
+        typer.echo(f"{name}: {value}")
+
+
+async def _backfill_entitlements(batch_size: int) -> int:
+    from services.entitlement_service import EntitlementService
+
+    await connect_to_mongo(initialize=False)
+    try:
+        service = EntitlementService()
+        await service.ensure_indexes()
+        return await service.backfill(batch_size=batch_size)
+    finally:
+        await close_mongo_connection()
+
+
+@app.command("backfill-entitlements")
+def backfill_entitlements(
+    batch_size: int = typer.Option(1000, help="Entitlement writes per bulk request"),
+):
+    """Record the books of every delivered order in the customer library"""
+    orders = asyncio.run(_backfill_entitlements(batch_size))
+    typer.echo(f"Backfilled entitlements from {orders} delivered orders")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,119 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+from metrics import registry
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+coalesced_counter = registry.counter(
+    "coalesced_reads_total", "Reads served by joining an identical in-flight lookup"
+)
+batches_counter = registry.counter(
+    "batched_loads_total", "Batched lookups sent to the database"
+)
+batch_keys_counter = registry.counter(
+    "batched_load_keys_total", "Distinct keys resolved by batched lookups"
+)
+
+
+class SingleFlight(Generic[K, V]):
+    """Collapses concurrent calls for the same key into one.
+
+    The first caller for a key runs the lookup; callers arriving while it is
+    in flight await the same result (or exception). Results are shared, so
+    callers must treat them as read-only. Nothing is cached once the lookup
+    completes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[K, asyncio.Future] = {}
+
+    async def do(self, key: K, fn: Callable[[], Awaitable[V]]) -> V:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._release(key, done))
+        else:
+            coalesced_counter.inc(loader=self.name)
+        # A cancelled waiter must not cancel the lookup the others share
+        return await asyncio.shield(future)
+
+    def _release(self, key: K, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            # Mark the exception retrieved even if every waiter went away
+            future.exception()
+
+    def forget(self, key: K):
+        """Make later calls start a fresh lookup (after a write to ``key``)"""
+        self._inflight.pop(key, None)
+
+
+class BatchLoader(Generic[K, V]):
+    """Gathers lookups arriving within ``window`` seconds into one batch.
+
+    ``load_many`` receives the distinct keys of a batch and returns a mapping
+    of the ones it found; missing keys resolve to None. A batch is sent as
+    soon as the window closes or ``max_batch`` keys are waiting, and keys
+    already in flight are joined rather than fetched again.
+    """
+
+    def __init__(self, name: str, load_many: Callable[[list], Awaitable[Dict[K, V]]],
+                 window: float = 0.002, max_batch: int = 100):
+        self.name = name
+        self.load_many = load_many
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[K, asyncio.Future] = {}
+        self._inflight: Dict[K, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def load(self, key: K) -> Optional[V]:
+        future = self._inflight.get(key) or self._pending.get(key)
+        if future is not None:
+            coalesced_counter.inc(loader=self.name)
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._dispatch)
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            self._inflight.update(batch)
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: Dict[K, asyncio.Future]):
+        batches_counter.inc(loader=self.name)
+        batch_keys_counter.inc(len(batch), loader=self.name)
+        try:
+            results = await self.load_many(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(results.get(key))
+        finally:
+            for key, future in batch.items():
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def forget(self, key: K):
+        """Make later loads of ``key`` wait for a fresh batch (after a write)"""
+        self._inflight.pop(key, None)
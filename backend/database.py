@@ -11,7 +11,7 @@ class Database:
 
 database = Database()
 
-async def connect_to_mongo():
+async def connect_to_mongo(initialize: bool = True):
     """Create database connection"""
     try:
         mongo_url = os.environ['MONGO_URL']
@@ -23,10 +23,11 @@ async def connect_to_mongo():
         logger.info("Successfully connected to MongoDB")
         
         # Initialize collections with sample data if empty
-        await initialize_sample_data()
+        if initialize:
+            await initialize_sample_data()
         
     except Exception as e:
-        logger.error(f"Error connecting to MongoDB: {e}")
+        logger.error("Error connecting to MongoDB: %s", e)
         raise e
 
 async def close_mongo_connection():
@@ -106,7 +107,7 @@ async def initialize_sample_data():
                 }
             ]
             await db.books.insert_many(sample_books)
-            logger.info(f"Inserted {len(sample_books)} sample books")
+            logger.info("Inserted %s sample books", len(sample_books))
         
         # Initialize Reviews
         reviews_count = await db.reviews.count_documents({})
@@ -150,7 +151,7 @@ async def initialize_sample_data():
                 }
             ]
             await db.reviews.insert_many(sample_reviews)
-            logger.info(f"Inserted {len(sample_reviews)} sample reviews")
+            logger.info("Inserted %s sample reviews", len(sample_reviews))
 
         # Initialize Author Info
         author_count = await db.author.count_documents({})
@@ -182,4 +183,4 @@ async def initialize_sample_data():
             logger.info("Inserted author information")
             
     except Exception as e:
-        logger.error(f"Error initializing sample data: {e}")
\ No newline at end of file
+        logger.error("Error initializing sample data: %s", e)
\ No newline at end of file
@@ -0,0 +1,108 @@
+import os
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "HS256"
+
+# Secrets shorter than this (or the sample value) are refused
+MIN_SECRET_LENGTH = 32
+PLACEHOLDER_MARKER = "change-me"
+
+
+@dataclass(frozen=True)
+class DownloadClaims:
+    order_id: str
+    book_id: str
+    expires_at: datetime
+
+
+class DownloadTokenSigner:
+    """Signs and verifies stateless download tokens (HS256 JWTs).
+
+    Tokens carry the order, the book and an expiry, so the download
+    endpoint can validate them without touching MongoDB; the file to serve
+    is always derived from the book, never taken from the token. Every
+    token names its signing key in the ``kid`` header; keys are configured
+    as ``DOWNLOAD_TOKEN_KEYS=<kid>:<secret>[,<kid>:<secret>...]`` and the
+    process refuses to start without them. The first key signs new tokens
+    and all of them verify, so a key can be rotated by prepending a new one
+    and dropping the old one once its tokens expire.
+    """
+
+    def __init__(self, keys: Dict[str, str], active_kid: str, ttl: timedelta = timedelta(hours=48)):
+        if active_kid not in keys:
+            raise ValueError(f"Unknown signing key: {active_kid}")
+        self.keys = keys
+        self.active_kid = active_kid
+        self.ttl = ttl
+        # Order ids whose links must stop working (e.g. refunded orders)
+        self.revoked: set = set()
+
+    @classmethod
+    def from_env(cls) -> "DownloadTokenSigner":
+        keys: Dict[str, str] = {}
+        for entry in os.getenv("DOWNLOAD_TOKEN_KEYS", "").split(","):
+            kid, _, secret = entry.strip().partition(":")
+            if kid and secret:
+                keys[kid] = secret
+
+        if not keys:
+            raise RuntimeError("DOWNLOAD_TOKEN_KEYS must be set (<kid>:<secret>[,...])")
+        for kid, secret in keys.items():
+            if len(secret) < MIN_SECRET_LENGTH or PLACEHOLDER_MARKER in secret:
+                raise RuntimeError(
+                    f"Download token key '{kid}' is a placeholder or shorter than "
+                    f"{MIN_SECRET_LENGTH} characters"
+                )
+
+        ttl = timedelta(hours=float(os.getenv("DOWNLOAD_LINK_TTL_HOURS", "48")))
+        return cls(keys, active_kid=next(iter(keys)), ttl=ttl)
+
+    def issue(self, order_id: str, book_id: str) -> Tuple[str, datetime]:
+        """Signed token and its (naive UTC) expiry"""
+        expires_at = datetime.utcnow().replace(microsecond=0) + self.ttl
+        claims = {
+            "oid": order_id,
+            "bid": book_id,
+            "exp": expires_at.replace(tzinfo=timezone.utc)
+        }
+        token = jwt.encode(claims, self.keys[self.active_kid], algorithm=ALGORITHM,
+                           headers={"kid": self.active_kid})
+        return token, expires_at
+
+    def verify(self, token: str) -> Optional[DownloadClaims]:
+        """Claims of a valid, unexpired and unrevoked token, else None"""
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            secret = self.keys.get(kid)
+            if secret is None:
+                return None
+            claims = jwt.decode(token, secret, algorithms=[ALGORITHM], options={"require": ["exp"]})
+        except jwt.PyJWTError:
+            return None
+
+        if claims.get("oid") in self.revoked:
+            return None
+
+        return DownloadClaims(
+            order_id=claims["oid"],
+            book_id=claims["bid"],
+            expires_at=datetime.utcfromtimestamp(claims["exp"])
+        )
+
+
+_signer: Optional[DownloadTokenSigner] = None
+
+
+def get_signer() -> DownloadTokenSigner:
+    """Process-wide signer, configured from the environment on first use"""
+    global _signer
+    if _signer is None:
+        _signer = DownloadTokenSigner.from_env()
+    return _signer
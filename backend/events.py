@@ -0,0 +1,83 @@
+import os
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Event names
+BOOKS_CHANGED = "books.changed"
+ORDER_DELIVERED = "order.delivered"
+ORDER_UPDATED = "order.updated"
+
+Handler = Callable[..., Awaitable[None]]
+
+handler_failures = registry.counter(
+    "event_handler_failures_total", "Background event handlers that failed after every retry"
+)
+
+
+class EventBus:
+    """In-process publish/subscribe for keeping derived state fresh.
+
+    Handlers run in the publisher's task, so they should only do cheap work
+    (mark a cache stale, schedule a background refresh). Handlers that
+    write to MongoDB subscribe with ``background=True``: they run in their
+    own task, retried with backoff up to EVENT_HANDLER_ATTEMPTS times, and
+    ``drain`` waits for them on shutdown. A failing handler is logged and
+    never breaks the write that published the event.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Tuple[Handler, bool]]] = defaultdict(list)
+        self._tasks: Set[asyncio.Task] = set()
+        self.attempts = int(os.getenv("EVENT_HANDLER_ATTEMPTS", "5"))
+        self.backoff = float(os.getenv("EVENT_HANDLER_BACKOFF_SECONDS", "1"))
+
+    def subscribe(self, event: str, handler: Handler, background: bool = False):
+        self._handlers[event].append((handler, background))
+
+    async def publish(self, event: str, **payload):
+        for handler, background in list(self._handlers.get(event, ())):
+            if background:
+                task = asyncio.create_task(self._run_with_retries(event, handler, payload))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                continue
+            try:
+                await handler(**payload)
+            except Exception as e:
+                logger.error("Error handling %s event in %s: %s",
+                             event, getattr(handler, "__qualname__", handler), e)
+
+    async def _run_with_retries(self, event: str, handler: Handler, payload: dict):
+        name = getattr(handler, "__qualname__", handler)
+        for attempt in range(1, self.attempts + 1):
+            try:
+                await handler(**payload)
+                return
+            except Exception as e:
+                if attempt == self.attempts:
+                    handler_failures.inc(event=event)
+                    logger.error("Giving up on %s event in %s after %s attempts: %s",
+                                 event, name, attempt, e)
+                    return
+                logger.warning("Error handling %s event in %s (attempt %s), retrying: %s",
+                               event, name, attempt, e)
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+    async def drain(self, timeout: float = 30.0):
+        """Wait for background handlers still running (e.g. before shutdown)"""
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning("%s background event handlers still running at shutdown", len(pending))
+            for task in pending:
+                task.cancel()
+
+
+bus = EventBus()
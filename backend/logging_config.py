@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+# Request-scoped context, propagated into every log record emitted while
+# handling the request.
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+route_var: ContextVar[str] = ContextVar("route", default="-")
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+_listener: Optional[QueueListener] = None
+
+# Attributes present on every LogRecord; anything else was passed via extra=
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "request_id", "route", "trace_id", "span_id", "suppressed"
+}
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request id and route to the record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.route = route_var.get()
+        return True
+
+
+class ErrorSamplingFilter(logging.Filter):
+    """Drop repeated warnings/errors once a route exceeds its burst.
+
+    Records are keyed by (route, logger, message template), so every distinct
+    failure is always logged at least ``burst`` times per ``window`` seconds.
+    The number of dropped records is reported on the first record that gets
+    through in the next window.
+    """
+
+    def __init__(self, burst: int = 10, window: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        # key -> [window_start, emitted, suppressed]
+        self._counters: Dict[Tuple[str, str, str], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+
+        key = (getattr(record, "route", "-"), record.name, str(record.msg))
+        now = time.monotonic()
+
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or now - counter[0] >= self.window:
+                suppressed = counter[2] if counter else 0
+                self._counters[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+
+            if counter[1] < self.burst:
+                counter[1] += 1
+                return True
+
+            counter[2] += 1
+            return False
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that defers all formatting to the listener thread.
+
+    The stock ``prepare()`` runs the full formatter on the calling thread; here
+    only the message is interpolated (args may be mutated after the call) and
+    the traceback rendered, everything else happens off the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block the event loop on logging; drop instead
+            pass
+
+
+class JsonFormatter(logging.Formatter):
+    """Render records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            "route": getattr(record, "route", "-"),
+            "trace_id": getattr(record, "trace_id", "0"),
+            "span_id": getattr(record, "span_id", "0"),
+        }
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            payload["suppressed"] = suppressed
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS:
+                payload[key] = value
+        if record.exc_text:
+            payload["exc_info"] = record.exc_text
+        elif record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+TEXT_FORMAT = (
+    '%(asctime)s - %(name)s - %(levelname)s - '
+    '[request_id=%(request_id)s trace_id=%(trace_id)s span_id=%(span_id)s] - %(message)s'
+)
+
+
+def setup_logging() -> QueueListener:
+    """Route all logging through a queue drained by a background thread.
+
+    Configured from LOG_LEVEL, LOG_FORMAT (``json`` or ``text``),
+    LOG_QUEUE_SIZE, LOG_SAMPLE_BURST and LOG_SAMPLE_WINDOW.
+    """
+    global _listener
+
+    if _listener is not None:
+        return _listener
+
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(ErrorSamplingFilter(
+        burst=int(os.getenv("LOG_SAMPLE_BURST", "10")),
+        window=float(os.getenv("LOG_SAMPLE_WINDOW", "60"))
+    ))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def bind_route(route: str):
+    """Record the matched route template for the current request"""
+    route_var.set(route)
+
+
+class RequestContextMiddleware:
+    """ASGI middleware assigning a correlation id to every request.
+
+    Honors an incoming ``X-Request-ID`` header and echoes the id back on the
+    response so clients can quote it in bug reports.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        token = request_id_var.set(request_id)
+        route_token = route_var.set(scope.get("path", "-"))
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER, request_id.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            route_var.reset(route_token)
+            request_id_var.reset(token)
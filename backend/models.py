@@ -29,6 +29,7 @@ class PaymentStatus(str, Enum):
 class Book(BaseModel):
     id: Optional[str] = Field(default=None, alias="_id")
     title: str
+    isbn: Optional[str] = None
     author: str = "María Fernández"
     price: float
     originalPrice: float
@@ -40,6 +41,7 @@ class Book(BaseModel):
     reviewCount: int = 0
     bestseller: bool = False
     fileUrl: Optional[str] = None
+    fileKey: Optional[str] = None  # Object key of the ebook file in storage
     createdAt: datetime = Field(default_factory=datetime.utcnow)
     updatedAt: datetime = Field(default_factory=datetime.utcnow)
 
@@ -49,6 +51,7 @@ class Book(BaseModel):
 
 class BookCreate(BaseModel):
     title: str
+    isbn: Optional[str] = None
     price: float
     originalPrice: float
     description: str
@@ -57,6 +60,7 @@ class BookCreate(BaseModel):
     pages: int
     bestseller: bool = False
     fileUrl: Optional[str] = None
+    fileKey: Optional[str] = None
 
 
 # Customer Models
@@ -80,6 +84,9 @@ class PaymentInfo(BaseModel):
     amount: float
     status: PaymentStatus = PaymentStatus.PENDING
     paymentMethod: Optional[str] = None
+    # Cached from the current PaymentIntent so retries can reuse it; never serialized
+    clientSecret: Optional[str] = Field(default=None, exclude=True)
+    intentAmountCents: Optional[int] = Field(default=None, exclude=True)
 
 
 class DownloadLink(BaseModel):
@@ -109,6 +116,30 @@ class OrderCreate(BaseModel):
     customer: CustomerInfo
 
 
+# Entitlement Models
+class Entitlement(BaseModel):
+    email: EmailStr
+    bookId: str
+    bookTitle: str
+    orderId: str
+    purchasedAt: datetime
+
+
+class LibraryRequest(BaseModel):
+    email: EmailStr
+    orderId: str  # Any order placed with this email, as proof of ownership
+
+
+class LibraryDownloadRequest(LibraryRequest):
+    bookId: str
+
+
+class LibraryResponse(BaseModel):
+    email: EmailStr
+    books: List[Entitlement]
+    total: int
+
+
 # Review Models
 class Review(BaseModel):
     id: Optional[str] = Field(default=None, alias="_id")
@@ -128,10 +159,11 @@ class Review(BaseModel):
 
 # Author Models
 class AuthorStats(BaseModel):
-    booksPublished: int = 12
-    readersReached: str = "500K+"
-    averageRating: float = 4.8
-    countries: int = 25
+    # Derived from books and delivered orders by AuthorService
+    booksPublished: int = 0
+    readersReached: str = "0"
+    averageRating: float = 0.0
+    countries: int = 0
 
 
 class SocialMedia(BaseModel):
@@ -158,7 +190,7 @@ class Author(BaseModel):
 # Stripe Models
 class PaymentIntentCreate(BaseModel):
     orderId: str
-    amount: float
+    amount: Optional[float] = None  # Optional; must match the order's amount if sent
 
 
 class PaymentIntentResponse(BaseModel):
@@ -0,0 +1,148 @@
+import re
+import time
+import random
+import asyncio
+import secrets
+import logging
+from pathlib import Path
+from typing import List, Optional
+
+from logging_config import request_id_var
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PROFILE_KEY_HEADER = b"x-profile-key"
+PROFILE_FORMAT_HEADER = b"x-profile-format"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+# Stored as <timestamp>-<method>-<path>-<request id>.<html|speedscope.json>
+PROFILE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+\.(html|speedscope\.json)$")
+
+profiles_counter = registry.counter("request_profiles_total", "Requests run under the profiler")
+
+
+class ProfileStore:
+    """Profiles written to a local directory, keeping the newest ``max_files``"""
+
+    def __init__(self, root: Path, max_files: int = 50):
+        self.root = Path(root)
+        self.max_files = max_files
+
+    def _files(self) -> List[Path]:
+        if not self.root.is_dir():
+            return []
+        files = [path for path in self.root.iterdir() if PROFILE_ID_PATTERN.match(path.name)]
+        return sorted(files, key=lambda path: path.stat().st_mtime, reverse=True)
+
+    def list(self) -> List[dict]:
+        return [
+            {
+                "id": path.name,
+                "size": path.stat().st_size,
+                "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(path.stat().st_mtime))
+            }
+            for path in self._files()
+        ]
+
+    def path_for(self, profile_id: str) -> Optional[Path]:
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = self.root / profile_id
+        return path if path.is_file() else None
+
+    def save(self, name: str, content: str):
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / name).write_text(content, encoding="utf-8")
+        for path in self._files()[self.max_files:]:
+            path.unlink(missing_ok=True)
+
+
+def _profile_name(scope, fmt: str) -> str:
+    path = re.sub(r"[^A-Za-z0-9]+", "_", scope.get("path", "")).strip("_")[:80] or "root"
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    request_id = re.sub(r"[^A-Za-z0-9]", "", request_id_var.get())[:32] or "-"
+    suffix = "speedscope.json" if fmt == "speedscope" else "html"
+    return f"{stamp}-{scope.get('method', 'GET')}-{path}-{request_id}.{suffix}"
+
+
+class ProfilingMiddleware:
+    """ASGI middleware running selected requests under pyinstrument.
+
+    A request is profiled when it carries the ADMIN_API_KEY in
+    ``X-Profile-Key`` or is picked by ``sample_rate``. ``X-Profile-Format:
+    speedscope`` selects speedscope JSON instead of HTML. At most one request
+    per worker is profiled at a time; the profile id is returned in
+    ``X-Profile-Id``. Only installed when PROFILING_ENABLED is set, so it
+    costs nothing otherwise.
+    """
+
+    def __init__(self, app, store: ProfileStore, admin_key: Optional[str] = None,
+                 sample_rate: float = 0.0, interval: float = 0.001, default_format: str = "html"):
+        self.app = app
+        self.store = store
+        self.admin_key = admin_key
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.default_format = default_format
+        self._busy = False
+
+    def _wants_profile(self, scope) -> Optional[str]:
+        """Output format if this request should be profiled, else None"""
+        key = fmt = None
+        for name, value in scope.get("headers", []):
+            if name == PROFILE_KEY_HEADER:
+                key = value
+            elif name == PROFILE_FORMAT_HEADER:
+                fmt = value.decode("latin-1").lower()
+
+        if key is not None:
+            # Compare bytes: compare_digest rejects non-ASCII str
+            if not self.admin_key or not secrets.compare_digest(key, self.admin_key.encode()):
+                return None
+        elif not (self.sample_rate and random.random() < self.sample_rate):
+            return None
+        return "speedscope" if fmt == "speedscope" else self.default_format
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._busy:
+            await self.app(scope, receive, send)
+            return
+
+        fmt = self._wants_profile(scope)
+        if fmt is None:
+            await self.app(scope, receive, send)
+            return
+
+        from pyinstrument import Profiler
+
+        name = _profile_name(scope, fmt)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_ID_HEADER, name.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        self._busy = True
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            self._busy = False
+            profiles_counter.inc()
+            try:
+                await asyncio.to_thread(self._save, profiler, name, fmt)
+            except Exception as e:
+                logger.error("Error saving profile %s: %s", name, e)
+
+    def _save(self, profiler, name: str, fmt: str):
+        if fmt == "speedscope":
+            from pyinstrument.renderers import SpeedscopeRenderer
+            content = profiler.output(renderer=SpeedscopeRenderer())
+        else:
+            content = profiler.output_html()
+        self.store.save(name, content)
@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+
+from database import get_database
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+rate_limited_counter = registry.counter(
+    "rate_limited_requests_total", "Requests rejected by a rate limit rule"
+)
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    """Token bucket of ``capacity`` tokens refilled over ``period`` seconds"""
+    name: str
+    capacity: int
+    period: float
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / self.period
+
+    @classmethod
+    def from_env(cls, name: str, variable: str, default: str) -> "RateLimitRule":
+        """Parse a ``<requests>/<seconds>`` spec such as ``10/60``"""
+        spec = os.getenv(variable, default)
+        capacity, period = spec.split("/")
+        return cls(name, int(capacity), float(period))
+
+
+class InMemoryBucketStore:
+    """Token buckets kept in this worker's memory.
+
+    Buckets are kept in least-recently-updated order, so once there are
+    more than ``max_keys`` the stalest ones are dropped from the front in
+    O(1) per take.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        # key -> (tokens, last update, rule period), oldest update first
+        self._buckets: "OrderedDict[str, Tuple[float, float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rule: RateLimitRule, cost: int = 1) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens, updated, _ = self._buckets.get(key, (rule.capacity, now, rule.period))
+        tokens = min(rule.capacity, tokens + (now - updated) * rule.refill_rate)
+
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now, rule.period)
+        self._buckets.move_to_end(key)
+
+        if len(self._buckets) > self.max_keys:
+            self._evict()
+
+        retry_after = 0.0 if allowed else (cost - tokens) / rule.refill_rate
+        return allowed, retry_after
+
+    def _evict(self):
+        """Drop the least recently updated buckets until back under max_keys"""
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+class MongoBucketStore:
+    """Token buckets shared by all workers in the ``rate_limits`` collection.
+
+    Each take is a single atomic ``find_one_and_update`` with an aggregation
+    pipeline, so concurrent workers never over-admit. Idle buckets expire
+    through a TTL index on ``expiresAt``.
+    """
+
+    collection_name = "rate_limits"
+
+    @property
+    def collection(self):
+        return get_database()[self.collection_name]
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expiresAt", expireAfterSeconds=0)
+
+    async def take(self, key: str, rule: RateLimitRule, cost: int = 1) -> Tuple[bool, float]:
+        now = time.time()
+        refilled = {
+            "$min": [
+                rule.capacity,
+                {"$add": [
+                    {"$ifNull": ["$tokens", rule.capacity]},
+                    {"$multiply": [
+                        {"$subtract": [now, {"$ifNull": ["$ts", now]}]},
+                        rule.refill_rate
+                    ]}
+                ]}
+            ]
+        }
+        pipeline = [
+            {"$set": {"tokens": refilled, "ts": now}},
+            {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+            {"$set": {
+                "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                "expiresAt": datetime.utcnow() + timedelta(seconds=rule.period)
+            }}
+        ]
+
+        try:
+            bucket = await self.collection.find_one_and_update(
+                {"_id": key},
+                pipeline,
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            # Fail open: a rate limiter outage must not take checkout down
+            logger.warning("Rate limit store unavailable, allowing request: %s", e)
+            return True, 0.0
+
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (cost - bucket["tokens"]) / rule.refill_rate
+
+
+class RateLimiter:
+    def __init__(self, store=None):
+        self.store = store or InMemoryBucketStore()
+        self.trust_forwarded = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+
+    def client_ip(self, request: Request) -> str:
+        if self.trust_forwarded:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        return request.client.host if request.client else "unknown"
+
+    async def hit(self, rule: RateLimitRule, identity: str, cost: int = 1):
+        """Consume from the bucket for ``identity`` or raise 429"""
+        allowed, retry_after = await self.store.take(f"{rule.name}:{identity}", rule, cost)
+        if not allowed:
+            rate_limited_counter.inc(rule=rule.name)
+            raise HTTPException(
+                status_code=429,
+                detail="Demasiadas solicitudes, intenta de nuevo más tarde",
+                headers={"Retry-After": str(max(1, int(retry_after + 0.5)))}
+            )
+
+    def by_ip(self, rule: RateLimitRule):
+        """FastAPI dependency limiting a route per client IP"""
+        async def dependency(request: Request):
+            await self.hit(rule, self.client_ip(request))
+        return dependency
+
+
+def create_rate_limiter() -> RateLimiter:
+    """Build the limiter selected by RATE_LIMIT_STORE (``memory`` or ``mongo``)"""
+    if os.getenv("RATE_LIMIT_STORE", "memory").lower() == "mongo":
+        return RateLimiter(MongoBucketStore())
+    return RateLimiter(InMemoryBucketStore())
+
+
+def email_identity(email: Optional[str]) -> str:
+    return (email or "").strip().lower()
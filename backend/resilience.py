@@ -0,0 +1,298 @@
+import re
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Optional, Tuple
+
+from metrics import registry
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+circuit_state_gauge = registry.gauge(
+    "circuit_breaker_state", "Circuit breaker state (0=closed, 1=half-open, 2=open)"
+)
+circuit_transitions = registry.counter(
+    "circuit_breaker_transitions_total", "Circuit breaker state transitions"
+)
+rejections_counter = registry.counter(
+    "dependency_rejections_total", "Calls rejected without reaching the dependency"
+)
+inflight_gauge = registry.gauge(
+    "bulkhead_inflight", "Calls currently holding a bulkhead permit"
+)
+admission_inflight_gauge = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"
+)
+admission_shed_counter = registry.counter(
+    "http_requests_shed_total", "HTTP requests rejected by admission control"
+)
+
+
+class ServiceUnavailableError(Exception):
+    """A dependency is temporarily unavailable; retry after ``retry_after`` seconds"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    pass
+
+
+class BulkheadFullError(ServiceUnavailableError):
+    pass
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker over a sliding time window.
+
+    Trips to ``open`` when at least ``min_calls`` outcomes were recorded in
+    the last ``window`` seconds and the failure share reaches
+    ``failure_rate``. After ``open_seconds`` it lets ``half_open_calls``
+    probes through; one failed probe re-opens it, all succeeding closes it.
+    ``allow_request`` returns a token that the caller hands back when
+    recording the outcome, so only calls admitted as probes of the current
+    half-open period count as probes.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 10,
+                 window: float = 30.0, open_seconds: float = 30.0, half_open_calls: int = 3):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        # Bumped on every move to half-open; probes carry it as their token
+        self._half_open_generation = 0
+        circuit_state_gauge.set(_STATE_VALUES[CLOSED], breaker=name)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        self.state = state
+        circuit_state_gauge.set(_STATE_VALUES[state], breaker=self.name)
+        circuit_transitions.inc(breaker=self.name, state=state)
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self._half_open_generation += 1
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        else:
+            self._outcomes.clear()
+            self._failures = 0
+
+    def _trim(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            _, ok = self._outcomes.popleft()
+            if not ok:
+                self._failures -= 1
+
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 1.0
+        return max(1.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def allow_request(self) -> Optional[int]:
+        """Reserve a call slot or raise CircuitOpenError.
+
+        Returns the probe token for calls admitted while half-open, else None.
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                rejections_counter.inc(dependency=self.name, reason="circuit_open")
+                raise CircuitOpenError(f"{self.name} circuit is open", self.retry_after())
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_calls:
+                rejections_counter.inc(dependency=self.name, reason="circuit_half_open")
+                raise CircuitOpenError(f"{self.name} circuit is half-open", 1.0)
+            self._probes_in_flight += 1
+            return self._half_open_generation
+        return None
+
+    def _is_probe(self, token: Optional[int]) -> bool:
+        return self.state == HALF_OPEN and token is not None and token == self._half_open_generation
+
+    def record_success(self, token: Optional[int] = None):
+        if self._is_probe(token):
+            self._probes_in_flight -= 1
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._transition(CLOSED)
+            return
+        self._record(True)
+
+    def record_failure(self, token: Optional[int] = None):
+        if self._is_probe(token):
+            self._transition(OPEN)
+            return
+        self._record(False)
+
+    def release(self, token: Optional[int] = None):
+        """Give back a reserved slot without recording an outcome"""
+        if self._is_probe(token):
+            self._probes_in_flight -= 1
+
+    def _record(self, ok: bool):
+        if self.state != CLOSED:
+            return
+        now = time.monotonic()
+        self._outcomes.append((now, ok))
+        if not ok:
+            self._failures += 1
+        self._trim(now)
+
+        total = len(self._outcomes)
+        if total >= self.min_calls and self._failures / total >= self.failure_rate:
+            self._transition(OPEN)
+
+
+class Bulkhead:
+    """Caps concurrent calls to a dependency.
+
+    Callers wait at most ``max_wait`` seconds for a permit and are rejected
+    with BulkheadFullError otherwise, so a slow dependency cannot tie up every
+    request being served. A permit is normally returned when the ``acquire``
+    block exits; ``BulkheadPermit.hold_until`` keeps it until work the block
+    gave up on (e.g. a timed-out call still running in a thread) finishes.
+    """
+
+    def __init__(self, name: str, max_concurrent: int = 20, max_wait: float = 0.1):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        inflight_gauge.set_function(lambda: self.in_flight, bulkhead=name)
+
+    @asynccontextmanager
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            rejections_counter.inc(dependency=self.name, reason="bulkhead_full")
+            raise BulkheadFullError(f"{self.name} bulkhead is full", 1.0)
+
+        self.in_flight += 1
+        permit = BulkheadPermit(self)
+        try:
+            yield permit
+        finally:
+            permit.close()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+class BulkheadPermit:
+    """One acquired bulkhead slot"""
+
+    def __init__(self, bulkhead: Bulkhead):
+        self._bulkhead = bulkhead
+        self._held_by: Optional[asyncio.Future] = None
+
+    def hold_until(self, future: asyncio.Future):
+        """Keep the slot until ``future`` is done, even past the acquire block"""
+        self._held_by = future
+
+    def close(self):
+        if self._held_by is None or self._held_by.done():
+            self._bulkhead._release()
+            return
+
+        def release(future: asyncio.Future):
+            # Nobody awaits abandoned work any more; don't warn about its result
+            if not future.cancelled():
+                future.exception()
+            self._bulkhead._release()
+
+        self._held_by.add_done_callback(release)
+
+
+@asynccontextmanager
+async def guarded(breaker: CircuitBreaker, bulkhead: Bulkhead,
+                  is_failure: Optional[Callable[[BaseException], bool]] = None):
+    """Run a block under both a circuit breaker and a bulkhead.
+
+    Exceptions for which ``is_failure`` returns False (e.g. a declined card)
+    count as a healthy response from the dependency.
+    """
+    token = breaker.allow_request()
+    try:
+        async with bulkhead.acquire() as permit:
+            yield permit
+    except BulkheadFullError:
+        breaker.release(token)
+        raise
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            breaker.release(token)
+        elif is_failure is None or is_failure(e):
+            breaker.record_failure(token)
+        else:
+            breaker.record_success(token)
+        raise
+    else:
+        breaker.record_success(token)
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware that sheds load once too many requests are in flight.
+
+    Requests beyond ``max_in_flight`` are answered immediately with 503 and
+    ``Retry-After`` instead of queueing behind slow ones. Paths matching one
+    of the ``exempt_paths`` regular expressions (metrics, long-lived streams
+    that are capped elsewhere) are always admitted.
+    """
+
+    def __init__(self, app, max_in_flight: int = 200, exempt_paths=(r"/api/metrics",)):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.exempt_paths = [re.compile(pattern) for pattern in exempt_paths]
+        self.in_flight = 0
+        admission_inflight_gauge.set_function(lambda: self.in_flight)
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or any(pattern.fullmatch(path) for pattern in self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        if self.in_flight >= self.max_in_flight:
+            admission_shed_counter.inc()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", b"1"),
+                ],
+            })
+            await send({
+                "type": "http.response.body",
+                "body": b'{"detail":"Servidor ocupado, intenta de nuevo en unos segundos"}',
+            })
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
@@ -1,27 +1,56 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends, Header, Query, UploadFile, File
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse, RedirectResponse, FileResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+import io
 import os
 import logging
+import secrets
+from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 import stripe
 
 # Import our models and services
 from models import (
     Book, BookListResponse, Order, OrderCreate, OrderResponse, 
     Review, Author, PaymentIntentCreate, PaymentIntentResponse, 
-    PaymentConfirm, ApiResponse
+    PaymentConfirm, ApiResponse, LibraryRequest, LibraryDownloadRequest,
+    LibraryResponse, DownloadLink, PaymentStatus, BookCategory
 )
 from database import connect_to_mongo, close_mongo_connection
 from services.book_service import BookService
+from services.catalog_snapshot import SORT_PATTERN
 from services.order_service import OrderService
-from services.stripe_service import StripeService
+from services.stripe_service import StripeService, to_cents
+from services.author_service import AuthorService
+from services.entitlement_service import EntitlementService
+from services.email_service import EmailService
+from services.export_service import OrderExportService
+from services.catalog_import_service import CatalogImportService
+from services.download_service import DownloadService
+from services.recommendation_service import RecommendationService
+from services.reconciliation_service import ReconciliationService
+from services.order_events_service import OrderEventsService
+from services.cover_service import CoverService, MEDIA_TYPES, width_bucket
+from storage import create_storage, LocalStorageBackend
+from tracing import setup_tracing, shutdown_tracing, install_log_correlation, span
+from logging_config import setup_logging, shutdown_logging, bind_route, RequestContextMiddleware
+from resilience import ServiceUnavailableError, AdmissionControlMiddleware
+from rate_limit import RateLimitRule, MongoBucketStore, create_rate_limiter, email_identity
+from metrics import registry
+from events import bus
+from download_tokens import get_signer
+from profiling import ProfileStore, ProfilingMiddleware
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Configure logging: JSON records handed to a background thread via a queue
+install_log_correlation()
+setup_logging()
+logger = logging.getLogger(__name__)
+
 # Create the main app
 app = FastAPI(
     title="Ebooks API", 
@@ -29,24 +58,81 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Tracing (opt-in via OTEL_TRACES_EXPORTER); must run before MongoDB connects
+setup_tracing(app)
+
+async def bind_request_route(request: Request):
+    """Tag log records with the matched route template"""
+    bind_route(request.scope["route"].path)
+
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", dependencies=[Depends(bind_request_route)])
 
 # Initialize services
 book_service = BookService()
 order_service = OrderService()
 stripe_service = StripeService()
+author_service = AuthorService()
+entitlement_service = EntitlementService()
+email_service = EmailService()
+export_service = OrderExportService()
+catalog_import_service = CatalogImportService()
+storage = create_storage()
+download_service = DownloadService(storage, book_service)
+cover_service = CoverService(storage, book_service)
+recommendation_service = RecommendationService(book_service)
+reconciliation_service = ReconciliationService(stripe_service, order_service)
+order_events_service = OrderEventsService()
+profile_store = ProfileStore(
+    Path(os.environ.get('PROFILE_DIR', ROOT_DIR / 'storage' / 'profiles')),
+    max_files=int(os.environ.get('PROFILE_MAX_FILES', '50'))
+)
+
+# Rate limits for endpoints that write orders or call Stripe ("<requests>/<seconds>")
+rate_limiter = create_rate_limiter()
+ORDERS_IP_LIMIT = RateLimitRule.from_env("orders:ip", "RATE_LIMIT_ORDERS_IP", "20/60")
+ORDERS_EMAIL_LIMIT = RateLimitRule.from_env("orders:email", "RATE_LIMIT_ORDERS_EMAIL", "5/60")
+PAYMENTS_IP_LIMIT = RateLimitRule.from_env("payments:ip", "RATE_LIMIT_PAYMENTS_IP", "30/60")
+PAYMENTS_EMAIL_LIMIT = RateLimitRule.from_env("payments:email", "RATE_LIMIT_PAYMENTS_EMAIL", "10/60")
+LIBRARY_IP_LIMIT = RateLimitRule.from_env("library:ip", "RATE_LIMIT_LIBRARY_IP", "30/60")
 
 # Startup and shutdown events
 @app.on_event("startup")
 async def startup_event():
+    # Refuse to start without real download token keys
+    get_signer()
     await connect_to_mongo()
-    logging.info("Application started successfully")
+    if isinstance(rate_limiter.store, MongoBucketStore):
+        await rate_limiter.store.ensure_indexes()
+    await entitlement_service.ensure_indexes()
+    await author_service.start()
+    await email_service.start()
+    await export_service.ensure_indexes()
+    await catalog_import_service.ensure_indexes()
+    await download_service.ensure_indexes()
+    await download_service.start()
+    await order_events_service.start()
+    logger.info("Application started successfully")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await author_service.stop()
+    await download_service.stop()
+    await order_events_service.stop()
+    await email_service.stop()
+    cover_service.shutdown()
+    # Let background event handlers (entitlements, recommendations) finish
+    await bus.drain()
     await close_mongo_connection()
-    logging.info("Application shutdown complete")
+    shutdown_tracing()
+    logger.info("Application shutdown complete")
+    shutdown_logging()
+
+async def require_admin(x_admin_key: Optional[str] = Header(default=None)):
+    """Allow only requests carrying the ADMIN_API_KEY in X-Admin-Key"""
+    admin_key = os.environ.get('ADMIN_API_KEY')
+    if not admin_key or not x_admin_key or not secrets.compare_digest(x_admin_key.encode("latin-1"), admin_key.encode()):
+        raise HTTPException(status_code=403, detail="Acceso denegado")
 
 # Root endpoint
 @api_router.get("/")
@@ -55,13 +141,51 @@ async def root():
 
 # Book endpoints
 @api_router.get("/books", response_model=BookListResponse)
-async def get_books():
-    """Get all books"""
+async def get_books(
+    category: Optional[BookCategory] = None,
+    bestseller: Optional[bool] = None,
+    min_price: Optional[float] = Query(default=None, alias="minPrice", ge=0),
+    max_price: Optional[float] = Query(default=None, alias="maxPrice", ge=0),
+    min_rating: Optional[float] = Query(default=None, alias="minRating", ge=0),
+    max_rating: Optional[float] = Query(default=None, alias="maxRating", ge=0),
+    min_original_price: Optional[float] = Query(default=None, alias="minOriginalPrice", ge=0),
+    max_original_price: Optional[float] = Query(default=None, alias="maxOriginalPrice", ge=0),
+    min_discount: Optional[float] = Query(default=None, alias="minDiscount"),
+    max_discount: Optional[float] = Query(default=None, alias="maxDiscount"),
+    min_review_count: Optional[int] = Query(default=None, alias="minReviewCount", ge=0),
+    max_review_count: Optional[int] = Query(default=None, alias="maxReviewCount", ge=0),
+    min_pages: Optional[int] = Query(default=None, alias="minPages", ge=0),
+    max_pages: Optional[int] = Query(default=None, alias="maxPages", ge=0),
+    min_created_at: Optional[datetime] = Query(default=None, alias="minCreatedAt"),
+    max_created_at: Optional[datetime] = Query(default=None, alias="maxCreatedAt"),
+    sort: Optional[str] = Query(default=None, pattern=SORT_PATTERN),
+    offset: int = Query(default=0, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1, le=500)
+):
+    """Get books, optionally filtered (inclusive min/max on any sortable
+    field), sorted (e.g. ``-discount``, ``price``, ``-createdAt``) and
+    paginated; ``total`` counts all matches"""
+    ranges = {
+        field: bounds
+        for field, bounds in (
+            ("price", (min_price, max_price)),
+            ("rating", (min_rating, max_rating)),
+            ("originalPrice", (min_original_price, max_original_price)),
+            ("discount", (min_discount, max_discount)),
+            ("reviewCount", (min_review_count, max_review_count)),
+            ("pages", (min_pages, max_pages)),
+            ("createdAt", (min_created_at, max_created_at)),
+        )
+        if bounds != (None, None)
+    }
     try:
-        books = await book_service.get_all_books()
-        return BookListResponse(books=books, total=len(books))
+        books, total = await book_service.query_books(
+            category=category, bestseller=bestseller, ranges=ranges, sort=sort,
+            offset=offset, limit=limit
+        )
+        return BookListResponse(books=books, total=total)
     except Exception as e:
-        logging.error(f"Error getting books: {e}")
+        logger.error("Error getting books: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @api_router.get("/books/{book_id}", response_model=Book)
@@ -75,7 +199,17 @@ async def get_book(book_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error getting book {book_id}: {e}")
+        logger.error("Error getting book %s: %s", book_id, e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+@api_router.get("/books/{book_id}/related", response_model=BookListResponse)
+async def get_related_books(book_id: str):
+    """Books customers also bought with this one"""
+    try:
+        books = await recommendation_service.get_related_books(book_id)
+        return BookListResponse(books=books, total=len(books))
+    except Exception as e:
+        logger.error("Error getting related books for %s: %s", book_id, e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @api_router.get("/books/category/{category}")
@@ -85,7 +219,7 @@ async def get_books_by_category(category: str):
         books = await book_service.get_books_by_category(category)
         return {"books": books, "total": len(books), "category": category}
     except Exception as e:
-        logging.error(f"Error getting books by category {category}: {e}")
+        logger.error("Error getting books by category %s: %s", category, e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @api_router.get("/books/featured/bestsellers")
@@ -95,12 +229,9 @@ async def get_bestsellers():
         books = await book_service.get_bestsellers()
         return {"books": books, "total": len(books)}
     except Exception as e:
-        logging.error(f"Error getting bestsellers: {e}")
+        logger.error("Error getting bestsellers: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
-# Include the router in the main app
-app.include_router(api_router)
-
 # Reviews endpoints
 @api_router.get("/reviews")
 async def get_reviews():
@@ -118,7 +249,7 @@ async def get_reviews():
         
         return {"reviews": reviews, "total": len(reviews)}
     except Exception as e:
-        logging.error(f"Error getting reviews: {e}")
+        logger.error("Error getting reviews: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @api_router.get("/reviews/book/{book_title}")
@@ -137,42 +268,47 @@ async def get_book_reviews(book_title: str):
         
         return {"reviews": reviews, "total": len(reviews), "bookTitle": book_title}
     except Exception as e:
-        logging.error(f"Error getting book reviews: {e}")
+        logger.error("Error getting book reviews: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 # Author endpoint
 @api_router.get("/author")
 async def get_author():
-    """Get author information"""
+    """Get author information (served from the in-memory snapshot)"""
     try:
-        from database import get_database
-        db = get_database()
-        author_data = await db.author.find_one({})
+        author_data = await author_service.get_author()
         
         if author_data:
-            author_data['_id'] = str(author_data['_id'])
             return {"author": author_data}
         else:
             raise HTTPException(status_code=404, detail="Información del autor no encontrada")
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error getting author: {e}")
+        logger.error("Error getting author: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 # Order endpoints
-@api_router.post("/orders", response_model=OrderResponse)
+@api_router.post(
+    "/orders",
+    response_model=OrderResponse,
+    dependencies=[Depends(rate_limiter.by_ip(ORDERS_IP_LIMIT))]
+)
 async def create_order(order_data: OrderCreate):
     """Create a new order"""
     try:
+        await rate_limiter.hit(ORDERS_EMAIL_LIMIT, email_identity(order_data.customer.email))
+        
         order = await order_service.create_order(order_data)
         return OrderResponse(
             orderId=order.orderId,
             status=order.status,
             message="Orden creada exitosamente"
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error creating order: {e}")
+        logger.error("Error creating order: %s", e)
         raise HTTPException(status_code=500, detail="Error creando la orden")
 
 @api_router.get("/orders/{order_id}", response_model=Order)
@@ -186,11 +322,42 @@ async def get_order(order_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error getting order {order_id}: {e}")
+        logger.error("Error getting order %s: %s", order_id, e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@api_router.get("/orders/{order_id}/events")
+async def order_events(order_id: str):
+    """Server-sent events with the order's status and download links,
+    pushed as they change (replaces polling GET /orders/{order_id})"""
+    if order_events_service.at_capacity():
+        raise HTTPException(
+            status_code=503,
+            detail="Demasiadas conexiones abiertas, intenta de nuevo más tarde",
+            headers={"Retry-After": "5"}
+        )
+    # Subscribe before reading the order so no change slips in between
+    queue = order_events_service.subscribe(order_id)
+    try:
+        order = await order_service.get_order_by_id(order_id)
+    except Exception as e:
+        order_events_service.unsubscribe(order_id, queue)
+        logger.error("Error getting order %s: %s", order_id, e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+    if not order:
+        order_events_service.unsubscribe(order_id, queue)
+        raise HTTPException(status_code=404, detail="Orden no encontrada")
+    
+    return StreamingResponse(
+        order_events_service.stream(queue, order),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Payment endpoints (Stripe integration)
-@api_router.post("/payments/create-intent")
+@api_router.post(
+    "/payments/create-intent",
+    dependencies=[Depends(rate_limiter.by_ip(PAYMENTS_IP_LIMIT))]
+)
 async def create_payment_intent(payment_data: PaymentIntentCreate):
     """Create Stripe Payment Intent"""
     try:
@@ -199,35 +366,51 @@ async def create_payment_intent(payment_data: PaymentIntentCreate):
         if not order:
             raise HTTPException(status_code=404, detail="Orden no encontrada")
         
-        # Create payment intent with Stripe
-        result = await stripe_service.create_payment_intent(
-            amount=payment_data.amount,
-            order_id=payment_data.orderId,
-            customer_email=order.customer.email
-        )
+        await rate_limiter.hit(PAYMENTS_EMAIL_LIMIT, email_identity(order.customer.email))
+        
+        if order.paymentInfo.status == PaymentStatus.COMPLETED:
+            raise HTTPException(status_code=400, detail="La orden ya fue pagada")
+        
+        # The order's amount was computed server-side in create_order
+        if payment_data.amount is not None and to_cents(payment_data.amount) != to_cents(order.paymentInfo.amount):
+            raise HTTPException(status_code=400, detail="El monto no coincide con la orden")
+        
+        # Reuse the order's payment intent when possible (reloads and retries)
+        result = await stripe_service.ensure_payment_intent(order)
         
         if not result["success"]:
             raise HTTPException(status_code=400, detail=result.get("error", "Error creando intento de pago"))
         
-        # Update order with payment intent ID
-        await order_service.update_payment_info(
-            payment_data.orderId,
-            result["paymentIntentId"],
-            "pending"
-        )
+        if result["outcome"] == "paid":
+            # Paid, but never confirmed: settle it instead of charging again
+            await order_service.update_payment_info(order.orderId, result["paymentIntentId"], "completed")
+            await order_service.generate_download_links(order.orderId)
+            raise HTTPException(status_code=400, detail="La orden ya fue pagada")
+        
+        if result["outcome"] != "reused":
+            # Remember the intent and its client secret for the next attempt
+            await order_service.save_payment_intent(
+                order.orderId,
+                result["paymentIntentId"],
+                result["clientSecret"],
+                to_cents(order.paymentInfo.amount)
+            )
         
         return PaymentIntentResponse(
             clientSecret=result["clientSecret"],
             paymentIntentId=result["paymentIntentId"]
         )
         
-    except HTTPException:
+    except (HTTPException, ServiceUnavailableError):
         raise
     except Exception as e:
-        logging.error(f"Error creating payment intent: {e}")
+        logger.error("Error creating payment intent: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
-@api_router.post("/payments/confirm")
+@api_router.post(
+    "/payments/confirm",
+    dependencies=[Depends(rate_limiter.by_ip(PAYMENTS_IP_LIMIT))]
+)
 async def confirm_payment(payment_confirm: PaymentConfirm):
     """Confirm payment and generate download links"""
     try:
@@ -237,6 +420,13 @@ async def confirm_payment(payment_confirm: PaymentConfirm):
         if not payment_result["success"] or payment_result["status"] != "succeeded":
             raise HTTPException(status_code=400, detail="Pago no confirmado")
         
+        # The intent must belong to this order and cover its full amount
+        pending_order = await order_service.get_order_by_id(payment_confirm.orderId)
+        if (not pending_order
+                or (payment_result["metadata"] or {}).get("order_id") != payment_confirm.orderId
+                or to_cents(payment_result["amount"]) < to_cents(pending_order.paymentInfo.amount)):
+            raise HTTPException(status_code=400, detail="Pago no confirmado")
+        
         # Update order status
         await order_service.update_payment_info(
             payment_confirm.orderId,
@@ -250,18 +440,129 @@ async def confirm_payment(payment_confirm: PaymentConfirm):
         if not order:
             raise HTTPException(status_code=400, detail="Error generando enlaces de descarga")
         
+        with span("DownloadLink.serialize", count=len(order.downloadLinks)):
+            download_links = [link.model_dump() for link in order.downloadLinks]
+        
         return {
             "success": True,
             "message": "Pago confirmado exitosamente",
-            "downloadLinks": [link.model_dump() for link in order.downloadLinks]
+            "downloadLinks": download_links
         }
         
+    except (HTTPException, ServiceUnavailableError):
+        raise
+    except Exception as e:
+        logger.error("Error confirming payment: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+# Cover image endpoint
+@api_router.get("/covers/{book_id}")
+async def get_cover(book_id: str, request: Request, w: Optional[int] = None, v: Optional[str] = None):
+    """Resized WebP/AVIF cover, bucketed by width and cached on disk"""
+    try:
+        fmt = cover_service.negotiate_format(request.headers.get("accept"))
+        variant = await cover_service.get_variant(book_id, width_bucket(w), fmt)
+        if not variant:
+            raise HTTPException(status_code=404, detail="Libro no encontrado")
+        
+        path, version = variant
+        # Versioned URLs never change content, so they can be cached forever
+        if v == version:
+            cache_control = "public, max-age=31536000, immutable"
+        else:
+            cache_control = "public, max-age=3600"
+        
+        return FileResponse(
+            path,
+            media_type=MEDIA_TYPES[fmt],
+            headers={
+                "Cache-Control": cache_control,
+                "ETag": f'"{version}-{path.stem}-{fmt}"',
+                "Vary": "Accept",
+                # Clients can append ?v=<version> to get an immutable URL
+                "X-Cover-Version": version
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error getting cover for book %s: %s", book_id, e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+# Customer library ("Mis Compras") endpoints
+@api_router.post(
+    "/library",
+    response_model=LibraryResponse,
+    dependencies=[Depends(rate_limiter.by_ip(LIBRARY_IP_LIMIT))]
+)
+async def get_library(library_request: LibraryRequest):
+    """List the books a customer owns"""
+    try:
+        books = await entitlement_service.get_library(
+            library_request.email, library_request.orderId
+        )
+        if books is None:
+            raise HTTPException(status_code=404, detail="No se encontraron compras para este cliente")
+        
+        return LibraryResponse(email=library_request.email, books=books, total=len(books))
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error confirming payment: {e}")
+        logger.error("Error getting library: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@api_router.post(
+    "/library/download",
+    response_model=DownloadLink,
+    dependencies=[Depends(rate_limiter.by_ip(LIBRARY_IP_LIMIT))]
+)
+async def create_library_download(download_request: LibraryDownloadRequest):
+    """Mint a fresh download link for a purchased book"""
+    try:
+        link = await entitlement_service.create_download_link(
+            download_request.email, download_request.orderId, download_request.bookId
+        )
+        if not link:
+            raise HTTPException(status_code=404, detail="Libro no encontrado en tus compras")
+        
+        return link
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error creating library download link: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+# Download endpoints
+@api_router.get("/download/{token}")
+async def download_book(token: str):
+    """Redirect to a short-lived storage URL for a purchased book"""
+    try:
+        url = await download_service.get_download_url(token)
+        if not url:
+            raise HTTPException(status_code=404, detail="Enlace de descarga inválido o expirado")
+        
+        return RedirectResponse(url, status_code=302, headers={"Cache-Control": "no-store"})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error resolving download token: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+@api_router.get("/files/{key:path}")
+async def get_local_file(key: str, expires: int, signature: str, filename: Optional[str] = None):
+    """Serve a file from local storage (development only)"""
+    if not isinstance(storage, LocalStorageBackend) or not storage.verify(key, expires, signature):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    
+    try:
+        path = storage.path_for(key)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    
+    return FileResponse(path, filename=filename)
+
 # Stripe configuration endpoint
 @api_router.get("/config/stripe")
 async def get_stripe_config():
@@ -270,6 +571,109 @@ async def get_stripe_config():
         "publishableKey": stripe_service.get_publishable_key()
     }
 
+# Admin endpoints
+@api_router.get("/admin/orders/export", dependencies=[Depends(require_admin)])
+async def export_orders(
+    start: datetime,
+    end: Optional[datetime] = None,
+    format: str = Query(default="csv", pattern="^(csv|parquet)$")
+):
+    """Stream orders created in [start, end) as CSV or Parquet, one row per item"""
+    if format == "parquet":
+        content = export_service.stream_parquet(start, end)
+        media_type = "application/vnd.apache.parquet"
+    else:
+        content = export_service.stream_csv(start, end)
+        media_type = "text/csv; charset=utf-8"
+    
+    filename = f"orders-{start:%Y%m%d}-{(end or datetime.utcnow()):%Y%m%d}.{format}"
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.post("/admin/payments/reconcile", dependencies=[Depends(require_admin)])
+async def reconcile_payments(start: datetime, end: Optional[datetime] = None):
+    """Settle or fail pending orders created in [start, end) from Stripe's records"""
+    return await reconciliation_service.reconcile(start, end)
+
+@api_router.post("/admin/orders/{order_id}/revoke-downloads", dependencies=[Depends(require_admin)])
+async def revoke_order_downloads(order_id: str):
+    """Invalidate every download link issued for an order (e.g. after a refund)"""
+    await download_service.revoke_order(order_id)
+    return {"orderId": order_id, "revoked": True}
+
+@api_router.post("/admin/books/import", dependencies=[Depends(require_admin)])
+async def import_books(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(default=None, pattern="^(jsonl|csv)$")
+):
+    """Bulk upsert books from a JSONL or CSV file; reports per-row errors"""
+    if format is None:
+        format = "csv" if (file.filename or "").lower().endswith(".csv") else "jsonl"
+    
+    # The upload is already spooled to a temporary file; read it as text in batches
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return await catalog_import_service.import_file(stream, format)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El archivo debe estar codificado en UTF-8")
+    finally:
+        stream.detach()
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Recent request profiles, newest first"""
+    return {"profiles": profile_store.list()}
+
+@api_router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """A stored profile (pyinstrument HTML or speedscope JSON)"""
+    path = profile_store.path_for(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    
+    media_type = "application/json" if profile_id.endswith(".json") else "text/html"
+    return FileResponse(path, media_type=media_type)
+
+# Metrics endpoint (Prometheus text format)
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Expose in-process metrics"""
+    return registry.render()
+
+@app.exception_handler(ServiceUnavailableError)
+async def service_unavailable_handler(request: Request, exc: ServiceUnavailableError):
+    """Shed requests quickly while a dependency is degraded"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Servicio de pagos no disponible temporalmente, intenta de nuevo más tarde"},
+        headers={"Retry-After": str(int(exc.retry_after + 0.5))}
+    )
+
+# Include the router in the main app (after all routes are registered)
+app.include_router(api_router)
+
+# Profile selected requests (X-Profile-Key or PROFILE_SAMPLE_RATE); not installed unless enabled
+if os.environ.get('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes'):
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        admin_key=os.environ.get('ADMIN_API_KEY'),
+        sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+        default_format=os.environ.get('PROFILE_FORMAT', 'html')
+    )
+
+# Shed load when too many requests are in flight in this worker (inside
+# CORS, so browsers can read the 503 and its Retry-After). Order event
+# streams are long-lived and capped by ORDER_EVENTS_MAX_STREAMS instead.
+app.add_middleware(
+    AdmissionControlMiddleware,
+    max_in_flight=int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', '200')),
+    exempt_paths=(r"/api/metrics", r"/api/orders/[^/]+/events")
+)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -277,11 +681,9 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+# Assign a correlation id to every request (outermost middleware)
+app.add_middleware(RequestContextMiddleware)
+
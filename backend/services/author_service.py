@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from models import AuthorStats, OrderStatus
+from database import get_database
+from tracing import traced
+from events import bus, BOOKS_CHANGED, ORDER_DELIVERED
+from coalescing import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def format_readers(count: int) -> str:
+    """Human-friendly reader count, e.g. 1530 -> '1.5K+'"""
+    if count >= 1_000_000:
+        return f"{count / 1_000_000:.1f}".rstrip("0").rstrip(".") + "M+"
+    if count >= 1_000:
+        return f"{count / 1_000:.1f}".rstrip("0").rstrip(".") + "K+"
+    return str(count)
+
+
+class AuthorService:
+    """Serves the author profile from an in-memory snapshot.
+
+    The snapshot (profile document plus stats derived from ``books`` and
+    delivered ``orders``) is rebuilt at startup, every
+    AUTHOR_STATS_REFRESH_SECONDS, and shortly after the catalog changes or an
+    order is delivered. Requests only touch MongoDB while there is no
+    snapshot (e.g. the startup refresh failed): then one request at a time
+    rebuilds it, at most every AUTHOR_STATS_RETRY_SECONDS.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase = None):
+        self._db = db
+        self.snapshot: Optional[dict] = None
+        self.refresh_interval = float(os.getenv("AUTHOR_STATS_REFRESH_SECONDS", "300"))
+        self.debounce = float(os.getenv("AUTHOR_STATS_DEBOUNCE_SECONDS", "2"))
+        self.retry_interval = float(os.getenv("AUTHOR_STATS_RETRY_SECONDS", "5"))
+        self._flight = SingleFlight("author")
+        self._last_attempt = float("-inf")
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._pending_refresh: Optional[asyncio.Task] = None
+
+        bus.subscribe(BOOKS_CHANGED, self.invalidate)
+        bus.subscribe(ORDER_DELIVERED, self.invalidate)
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        return self._db if self._db is not None else get_database()
+
+    @traced()
+    async def compute_stats(self) -> AuthorStats:
+        """Compute author stats in a single aggregation over books and orders"""
+        pipeline = [
+            {
+                "$group": {
+                    "_id": None,
+                    "booksPublished": {"$sum": 1},
+                    "averageRating": {"$avg": "$rating"},
+                    "weightedRating": {"$sum": {"$multiply": ["$rating", "$reviewCount"]}},
+                    "totalReviews": {"$sum": "$reviewCount"}
+                }
+            },
+            # Count distinct values by grouping on them (one $lookup per count),
+            # so no single document has to hold every email
+            {
+                "$lookup": {
+                    "from": "orders",
+                    "pipeline": [
+                        {"$match": {"status": OrderStatus.DELIVERED.value}},
+                        {"$group": {"_id": "$customer.email"}},
+                        {"$count": "n"}
+                    ],
+                    "as": "readers"
+                }
+            },
+            {
+                "$lookup": {
+                    "from": "orders",
+                    "pipeline": [
+                        {"$match": {"status": OrderStatus.DELIVERED.value}},
+                        {"$group": {"_id": "$customer.country"}},
+                        {"$count": "n"}
+                    ],
+                    "as": "countries"
+                }
+            }
+        ]
+
+        cursor = self.db.books.aggregate(pipeline, allowDiskUse=True)
+        results = await cursor.to_list(length=1)
+        if not results:
+            return AuthorStats()
+
+        books = results[0]
+        readers = books["readers"][0]["n"] if books["readers"] else 0
+        countries = books["countries"][0]["n"] if books["countries"] else 0
+
+        # Weight the average by review count so one unreviewed title can't skew it
+        if books["totalReviews"]:
+            average_rating = books["weightedRating"] / books["totalReviews"]
+        else:
+            average_rating = books["averageRating"] or 0
+
+        return AuthorStats(
+            booksPublished=books["booksPublished"],
+            readersReached=format_readers(readers),
+            averageRating=round(average_rating, 1),
+            countries=countries
+        )
+
+    @traced()
+    async def refresh(self) -> Optional[dict]:
+        """Rebuild the snapshot from MongoDB"""
+        author_data = await self.db.author.find_one({})
+        if not author_data:
+            self.snapshot = None
+            return None
+
+        author_data['_id'] = str(author_data['_id'])
+        author_data['stats'] = (await self.compute_stats()).model_dump()
+        self.snapshot = author_data
+        return author_data
+
+    async def get_author(self) -> Optional[dict]:
+        """Get the author profile with current stats"""
+        if self.snapshot is None and time.monotonic() - self._last_attempt >= self.retry_interval:
+            await self._flight.do("snapshot", self._refresh_on_demand)
+        return self.snapshot
+
+    async def _refresh_on_demand(self) -> Optional[dict]:
+        self._last_attempt = time.monotonic()
+        return await self.refresh()
+
+    async def invalidate(self, **_):
+        """Schedule a debounced refresh after catalog or order changes"""
+        if self._pending_refresh is None or self._pending_refresh.done():
+            self._pending_refresh = asyncio.create_task(self._refresh_soon())
+
+    async def _refresh_soon(self):
+        await asyncio.sleep(self.debounce)
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error("Error refreshing author stats: %s", e)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error("Error refreshing author stats: %s", e)
+
+    async def start(self):
+        """Build the first snapshot and start the periodic refresh"""
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error("Error building author snapshot: %s", e)
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._refresh_task, self._pending_refresh):
+            if task is not None:
+                task.cancel()
+        self._refresh_task = None
+        self._pending_refresh = None
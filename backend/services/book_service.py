@@ -1,17 +1,51 @@
-from typing import List, Optional
+import os
+import time
+import asyncio
+from typing import Dict, List, Optional, Tuple
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from datetime import datetime
 
 from models import Book, BookCreate
 from database import get_database
+from tracing import traced, span
+from events import bus, BOOKS_CHANGED
+from coalescing import BatchLoader
+from services.catalog_snapshot import CatalogSnapshot
 
 
 class BookService:
     def __init__(self, db: AsyncIOMotorDatabase = None):
-        self.db = db or get_database()
-        self.collection = self.db.books
+        self._db = db
+        # Concurrent get_book_by_id calls within a couple of milliseconds
+        # share one $in query
+        self._loader = BatchLoader("books", self.get_books_by_ids)
+        # Columnar copy of the catalog for sorted/filtered listings; rebuilt
+        # after catalog changes, and periodically to pick up other workers' writes
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._snapshot_built_at = 0.0
+        self._snapshot_generation = 0
+        self._snapshot_lock = asyncio.Lock()
+        self.snapshot_ttl = float(os.getenv("CATALOG_SNAPSHOT_TTL_SECONDS", "60"))
+        bus.subscribe(BOOKS_CHANGED, self.invalidate_snapshot)
 
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        # Resolved lazily: services are created at import time, before
+        # connect_to_mongo() has run.
+        return self._db if self._db is not None else get_database()
+
+    @property
+    def collection(self):
+        return self.db.books
+
+    def _to_book(self, book_data: dict) -> Book:
+        """Validate a raw MongoDB document into a Book"""
+        book_data['_id'] = str(book_data['_id'])
+        with span("Book.validate"):
+            return Book(**book_data)
+
+    @traced()
     async def get_all_books(self) -> List[Book]:
         """Get all books"""
         cursor = self.collection.find({})
@@ -19,24 +53,75 @@ class BookService:
         
         books = []
         for book_data in books_data:
-            book_data['_id'] = str(book_data['_id'])
-            books.append(Book(**book_data))
+            books.append(self._to_book(book_data))
         
         return books
 
+    async def invalidate_snapshot(self, **_):
+        self._snapshot = None
+        self._snapshot_generation += 1
+
+    async def get_snapshot(self) -> CatalogSnapshot:
+        """Current columnar catalog snapshot, rebuilt if stale"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._snapshot_built_at < self.snapshot_ttl:
+            return snapshot
+
+        async with self._snapshot_lock:
+            # Another request may have rebuilt it while we waited
+            if self._snapshot is not None and time.monotonic() - self._snapshot_built_at < self.snapshot_ttl:
+                return self._snapshot
+            generation = self._snapshot_generation
+            books = await self.get_all_books()
+            with span("CatalogSnapshot.build", books=len(books)):
+                snapshot = CatalogSnapshot(books)
+            # Don't keep a snapshot that a concurrent write already made stale
+            if generation == self._snapshot_generation:
+                self._snapshot = snapshot
+                self._snapshot_built_at = time.monotonic()
+            return snapshot
+
+    async def get_cached_book(self, book_id: str) -> Optional[Book]:
+        """Book from the in-memory snapshot, falling back to MongoDB for
+        books added since it was built"""
+        if not ObjectId.is_valid(book_id):
+            return None
+        book = (await self.get_snapshot()).get(str(ObjectId(book_id)))
+        if book is None:
+            book = await self.get_book_by_id(book_id)
+        return book
+
+    @traced()
+    async def query_books(self, **filters) -> Tuple[List[Book], int]:
+        """Filtered, sorted page of the catalog from the in-memory snapshot
+        (see CatalogSnapshot.query for the filters)"""
+        snapshot = await self.get_snapshot()
+        with span("CatalogSnapshot.query"):
+            return snapshot.query(**filters)
+
+    @traced()
     async def get_book_by_id(self, book_id: str) -> Optional[Book]:
         """Get book by ID"""
         if not ObjectId.is_valid(book_id):
             return None
-            
-        book_data = await self.collection.find_one({"_id": ObjectId(book_id)})
+
+        # Results are keyed by the canonical (lower-case hex) id
+        return await self._loader.load(str(ObjectId(book_id)))
+
+    @traced()
+    async def get_books_by_ids(self, book_ids: List[str]) -> Dict[str, Book]:
+        """Get several books in one query, keyed by ID"""
+        object_ids = [ObjectId(book_id) for book_id in book_ids if ObjectId.is_valid(book_id)]
+        cursor = self.collection.find({"_id": {"$in": object_ids}})
         
-        if book_data:
-            book_data['_id'] = str(book_data['_id'])
-            return Book(**book_data)
+        books = {}
+        async for book_data in cursor:
+            book = self._to_book(book_data)
+            books[book.id] = book
         
-        return None
+        return books
 
+    @traced()
     async def get_books_by_category(self, category: str) -> List[Book]:
         """Get books by category"""
         cursor = self.collection.find({"category": category})
@@ -44,11 +129,11 @@ class BookService:
         
         books = []
         for book_data in books_data:
-            book_data['_id'] = str(book_data['_id'])
-            books.append(Book(**book_data))
+            books.append(self._to_book(book_data))
         
         return books
 
+    @traced()
     async def get_bestsellers(self) -> List[Book]:
         """Get bestseller books"""
         cursor = self.collection.find({"bestseller": True})
@@ -56,11 +141,11 @@ class BookService:
         
         books = []
         for book_data in books_data:
-            book_data['_id'] = str(book_data['_id'])
-            books.append(Book(**book_data))
+            books.append(self._to_book(book_data))
         
         return books
 
+    @traced()
     async def create_book(self, book_create: BookCreate) -> Book:
         """Create a new book"""
         book_data = book_create.model_dump()
@@ -70,12 +155,17 @@ class BookService:
         result = await self.collection.insert_one(book_data)
         book_data['_id'] = str(result.inserted_id)
         
+        await bus.publish(BOOKS_CHANGED, action="created", book_id=book_data['_id'],
+                          fields=list(book_data))
         return Book(**book_data)
 
+    @traced()
     async def update_book(self, book_id: str, book_update: dict) -> Optional[Book]:
         """Update a book"""
         if not ObjectId.is_valid(book_id):
             return None
+        # Canonical form, as keyed by the loader and in BOOKS_CHANGED
+        book_id = str(ObjectId(book_id))
             
         book_update['updatedAt'] = datetime.utcnow()
         
@@ -84,21 +174,32 @@ class BookService:
             {"$set": book_update},
             return_document=True
         )
+        # Reads already in flight may predate the write; don't let new callers join them
+        self._loader.forget(book_id)
         
         if result:
-            result['_id'] = str(result['_id'])
-            return Book(**result)
+            await bus.publish(BOOKS_CHANGED, action="updated", book_id=book_id,
+                              fields=list(book_update))
+            return self._to_book(result)
         
         return None
 
+    @traced()
     async def delete_book(self, book_id: str) -> bool:
         """Delete a book"""
         if not ObjectId.is_valid(book_id):
             return False
-            
+        book_id = str(ObjectId(book_id))
+
         result = await self.collection.delete_one({"_id": ObjectId(book_id)})
-        return result.deleted_count > 0
+        self._loader.forget(book_id)
+        if result.deleted_count > 0:
+            await bus.publish(BOOKS_CHANGED, action="deleted", book_id=book_id, fields=[])
+            return True
+        
+        return False
 
+    @traced()
     async def get_book_stats(self) -> dict:
         """Get book statistics"""
         total_books = await self.collection.count_documents({})
@@ -0,0 +1,100 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from models import Book, BookCategory
+
+CATEGORIES = list(BookCategory)
+
+# Fields /api/books can sort on; a leading "-" sorts descending
+SORT_FIELDS = ("price", "originalPrice", "discount", "rating", "reviewCount", "pages", "createdAt")
+SORT_PATTERN = "^-?(" + "|".join(SORT_FIELDS) + ")$"
+
+# field -> (min, max), either bound optional; every sort field can be ranged
+Bound = Union[int, float, datetime, None]
+Ranges = Dict[str, Tuple[Bound, Bound]]
+
+
+def _timestamp(value: datetime) -> int:
+    """Microseconds since the epoch, as stored in the createdAt column"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return int(np.datetime64(value, "us").astype(np.int64))
+
+
+class CatalogSnapshot:
+    """Read-only columnar copy of the catalog.
+
+    One NumPy array per sortable/filterable field, aligned with ``books``, so
+    a query is a vectorized mask plus a stable ``argsort`` over the matches
+    instead of a MongoDB round trip.
+    """
+
+    def __init__(self, books: List[Book]):
+        self.books = books
+        self._index = {book.id: i for i, book in enumerate(books)}
+        self.price = np.array([book.price for book in books], dtype=np.float64)
+        self.original_price = np.array([book.originalPrice for book in books], dtype=np.float64)
+        self.discount = self.original_price - self.price
+        self.rating = np.array([book.rating for book in books], dtype=np.float64)
+        self.review_count = np.array([book.reviewCount for book in books], dtype=np.int64)
+        self.pages = np.array([book.pages for book in books], dtype=np.int64)
+        self.created_at = np.array(
+            [book.createdAt for book in books], dtype="datetime64[us]"
+        ).astype(np.int64)
+        self.category = np.array([CATEGORIES.index(book.category) for book in books], dtype=np.int16)
+        self.bestseller = np.array([book.bestseller for book in books], dtype=bool)
+
+        self._columns = {
+            "price": self.price,
+            "originalPrice": self.original_price,
+            "discount": self.discount,
+            "rating": self.rating,
+            "reviewCount": self.review_count,
+            "pages": self.pages,
+            "createdAt": self.created_at,
+        }
+
+    def __len__(self) -> int:
+        return len(self.books)
+
+    def get(self, book_id: str) -> Optional[Book]:
+        i = self._index.get(book_id)
+        return None if i is None else self.books[i]
+
+    def query(self, category: Optional[str] = None, bestseller: Optional[bool] = None,
+              ranges: Optional[Ranges] = None,
+              sort: Optional[str] = None, offset: int = 0,
+              limit: Optional[int] = None) -> Tuple[List[Book], int]:
+        """Matching books (one page of them) and the total number of matches.
+
+        ``ranges`` bounds any of SORT_FIELDS inclusively, e.g.
+        ``{"price": (None, 20), "createdAt": (since, None)}``. Without
+        ``sort`` books keep the collection's natural order.
+        """
+        mask = np.ones(len(self.books), dtype=bool)
+        if category is not None:
+            try:
+                mask &= self.category == CATEGORIES.index(BookCategory(category))
+            except ValueError:
+                return [], 0
+        if bestseller is not None:
+            mask &= self.bestseller == bestseller
+        for field, (low, high) in (ranges or {}).items():
+            column = self._columns[field]
+            if low is not None:
+                mask &= column >= (_timestamp(low) if isinstance(low, datetime) else low)
+            if high is not None:
+                mask &= column <= (_timestamp(high) if isinstance(high, datetime) else high)
+
+        indices = np.flatnonzero(mask)
+        if sort:
+            descending = sort.startswith("-")
+            values = self._columns[sort.lstrip("-")][indices]
+            # Stable, so ties keep the natural order in both directions
+            indices = indices[np.argsort(-values if descending else values, kind="stable")]
+
+        total = len(indices)
+        end = None if limit is None else offset + limit
+        return [self.books[i] for i in indices[offset:end]], total
@@ -0,0 +1,306 @@
+import io
+import os
+import time
+import asyncio
+import threading
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+import requests
+from PIL import Image
+
+from storage import StorageBackend
+from events import bus, BOOKS_CHANGED
+from services.book_service import BookService
+
+logger = logging.getLogger(__name__)
+
+COVER_WIDTHS = (160, 320, 480, 640, 960, 1280)
+
+MEDIA_TYPES = {"webp": "image/webp", "avif": "image/avif"}
+
+# Source covers larger than this (bytes downloaded, or pixels once decoded) are refused
+SOURCE_MAX_BYTES = int(os.getenv("COVER_SOURCE_MAX_BYTES", str(20 * 1024 * 1024)))
+SOURCE_MAX_PIXELS = int(os.getenv("COVER_SOURCE_MAX_PIXELS", str(40_000_000)))
+Image.MAX_IMAGE_PIXELS = SOURCE_MAX_PIXELS
+
+
+def avif_supported() -> bool:
+    Image.init()
+    return "AVIF" in Image.SAVE
+
+
+@lru_cache(maxsize=4096)
+def cover_version(cover_url: str) -> str:
+    return hashlib.sha1(cover_url.encode("utf-8")).hexdigest()[:12]
+
+
+def width_bucket(width: Optional[int]) -> int:
+    """Smallest configured width that is at least ``width``"""
+    if not width:
+        return COVER_WIDTHS[2]
+    for bucket in COVER_WIDTHS:
+        if bucket >= width:
+            return bucket
+    return COVER_WIDTHS[-1]
+
+
+def download_source(url: str) -> Tuple[bytes, Optional[str]]:
+    """Body and content type of a cover URL, streamed and capped at
+    SOURCE_MAX_BYTES (runs in a worker thread)"""
+    with requests.get(url, timeout=15, stream=True) as response:
+        response.raise_for_status()
+        length = response.headers.get("content-length")
+        if length and length.isdigit() and int(length) > SOURCE_MAX_BYTES:
+            raise ValueError(f"Cover {url} is larger than {SOURCE_MAX_BYTES} bytes")
+
+        body = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            body += chunk
+            if len(body) > SOURCE_MAX_BYTES:
+                raise ValueError(f"Cover {url} is larger than {SOURCE_MAX_BYTES} bytes")
+        return bytes(body), response.headers.get("content-type")
+
+
+def render_variant(source: bytes, width: int, fmt: str) -> bytes:
+    """Resize and encode a cover (runs in a worker process)"""
+    with Image.open(io.BytesIO(source)) as image:
+        # Checked before decoding; Pillow itself only warns below 2x the limit
+        if image.width * image.height > SOURCE_MAX_PIXELS:
+            raise ValueError(f"Cover is larger than {SOURCE_MAX_PIXELS} pixels")
+        image = image.convert("RGB")
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.LANCZOS)
+        out = io.BytesIO()
+        if fmt == "avif":
+            image.save(out, format="AVIF", quality=55)
+        else:
+            image.save(out, format="WEBP", quality=80, method=4)
+        return out.getvalue()
+
+
+class DiskLRUCache:
+    """Files on disk, evicted least-recently-used once over ``max_bytes``.
+
+    The directory may be shared by several worker processes, each with its
+    own in-memory index. Hits bump the file's mtime and files written by
+    other workers are picked up on first use. The index is re-read from
+    disk (oldest mtime first) at most every ``rescan_seconds`` on writes and
+    always before evicting, so the budget covers every worker's files.
+    Eviction goes down to ``low_water`` of ``max_bytes`` so the rescan is
+    not repeated on every write. Methods do blocking file I/O and are safe
+    to call from worker threads (CoverService runs them via to_thread).
+    """
+
+    def __init__(self, root: Path, max_bytes: int, low_water: float = 0.9,
+                 rescan_seconds: float = 30.0):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.rescan_seconds = rescan_seconds
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._load()
+
+    def _load(self):
+        files = []
+        for path in self.root.rglob("*"):
+            try:
+                if path.is_file() and not path.name.endswith(".tmp"):
+                    stat = path.stat()
+                    files.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                continue  # Evicted by another worker meanwhile
+        files.sort(key=lambda file: file[0])
+
+        self._entries.clear()
+        self._size = 0
+        self._loaded_at = time.monotonic()
+        for _, size, path in files:
+            self._entries[str(path.relative_to(self.root))] = size
+            self._size += size
+
+    def path(self, name: str) -> Path:
+        return self.root / name
+
+    def get(self, name: str) -> Optional[Path]:
+        path = self.path(name)
+        try:
+            # Shared recency for the other workers' rescans
+            os.utime(path)
+            size = path.stat().st_size
+        except FileNotFoundError:
+            with self._lock:
+                if name in self._entries:
+                    self._size -= self._entries.pop(name)
+            return None
+
+        with self._lock:
+            if name not in self._entries:
+                # Rendered by another worker
+                self._entries[name] = size
+                self._size += size
+            self._entries.move_to_end(name)
+        return path
+
+    def put(self, name: str, data: bytes) -> Path:
+        path = self.path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+
+        with self._lock:
+            if name in self._entries:
+                self._size -= self._entries.pop(name)
+            self._entries[name] = len(data)
+            self._size += len(data)
+            self._evict()
+        return path
+
+    def remove_prefix(self, prefix: str):
+        with self._lock:
+            for name in [name for name in self._entries if name.startswith(prefix)]:
+                self._size -= self._entries.pop(name)
+                self.path(name).unlink(missing_ok=True)
+
+    def _evict(self):
+        """Called with the lock held"""
+        if time.monotonic() - self._loaded_at >= self.rescan_seconds:
+            self._load()
+        if self._size <= self.max_bytes:
+            return
+        self._load()
+        target = self.max_bytes * self.low_water
+        while self._size > target and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.path(name).unlink(missing_ok=True)
+
+
+class CoverService:
+    """Width-bucketed WebP/AVIF cover variants with a disk cache.
+
+    The source image is read from storage under
+    ``covers/<book_id>/<version>/source``
+    (fetched once from the book's ``cover`` URL if missing, up to
+    COVER_SOURCE_MAX_BYTES and COVER_SOURCE_MAX_PIXELS). The version is a
+    hash of the cover URL, read from BookService's catalog snapshot, so
+    every worker picks up a cover change within CATALOG_SNAPSHOT_TTL_SECONDS.
+    Variants are encoded in a process pool, cached on disk with LRU
+    eviction, and precomputed whenever a book's cover changes.
+    """
+
+    def __init__(self, storage: StorageBackend, book_service: BookService):
+        self.storage = storage
+        self.book_service = book_service
+        self.cache = DiskLRUCache(
+            Path(os.getenv("COVER_CACHE_DIR", Path(__file__).parent.parent / "storage" / "cover-cache")),
+            int(os.getenv("COVER_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+        )
+        self.formats = ("avif", "webp") if avif_supported() else ("webp",)
+        self._workers = int(os.getenv("COVER_WORKERS", "2"))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Running precompute tasks, referenced so they aren't garbage collected
+        self._tasks: Set[asyncio.Task] = set()
+
+        bus.subscribe(BOOKS_CHANGED, self.on_books_changed)
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        return self._executor
+
+    def negotiate_format(self, accept: Optional[str]) -> str:
+        if accept and "image/avif" in accept and "avif" in self.formats:
+            return "avif"
+        return "webp"
+
+    async def _cover_version(self, book_id: str) -> Optional[Tuple[str, str]]:
+        """(version, cover URL) for a book; versions change whenever the cover does"""
+        book = await self.book_service.get_cached_book(book_id)
+        if not book:
+            return None
+        return cover_version(book.cover), book.cover
+
+    async def _load_source(self, book_id: str, version: str, cover_url: str) -> bytes:
+        key = f"covers/{book_id}/{version}/source"
+        if await self.storage.exists(key):
+            return await self.storage.get(key)
+
+        content, content_type = await asyncio.to_thread(download_source, cover_url)
+        await self.storage.put(key, content, content_type)
+        return content
+
+    async def get_variant(self, book_id: str, width: int, fmt: str) -> Optional[Tuple[Path, str]]:
+        """Path of the cached variant (rendering it if needed) and its version"""
+        cover = await self._cover_version(book_id)
+        if cover is None:
+            return None
+        version, cover_url = cover
+
+        name = f"{book_id}/{version}-{width}.{fmt}"
+        path = await asyncio.to_thread(self.cache.get, name)
+        if path is not None:
+            return path, version
+
+        # Collapse concurrent requests for the same variant into one render
+        future = self._inflight.get(name)
+        if future is None:
+            future = asyncio.ensure_future(self._render(book_id, version, cover_url, name, width, fmt))
+            self._inflight[name] = future
+            future.add_done_callback(lambda _: self._inflight.pop(name, None))
+        return await asyncio.shield(future), version
+
+    async def _render(self, book_id: str, version: str, cover_url: str,
+                      name: str, width: int, fmt: str) -> Path:
+        source = await self._load_source(book_id, version, cover_url)
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(self.executor, render_variant, source, width, fmt)
+        return await asyncio.to_thread(self.cache.put, name, data)
+
+    async def precompute(self, book_id: str):
+        """Render every width/format variant of a book's current cover"""
+        # Drop variants of the previous cover
+        await asyncio.to_thread(self.cache.remove_prefix, f"{book_id}/")
+
+        for width in COVER_WIDTHS:
+            for fmt in self.formats:
+                try:
+                    await self.get_variant(book_id, width, fmt)
+                except Exception as e:
+                    logger.error("Error precomputing cover %s (%s, %s): %s", book_id, width, fmt, e)
+                    return
+
+    async def on_books_changed(self, action: str, book_id: Optional[str], fields, **_):
+        # Bulk changes (catalog import) render on demand
+        if book_id is None:
+            return
+
+        if action == "deleted":
+            coroutine = asyncio.to_thread(self.cache.remove_prefix, f"{book_id}/")
+        elif "cover" in fields:
+            coroutine = self.precompute(book_id)
+        else:
+            return
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,143 @@
+import os
+import asyncio
+import logging
+import posixpath
+from datetime import datetime
+from typing import Optional
+from urllib.parse import urlparse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from models import DownloadLink
+from database import get_database
+from storage import StorageBackend
+from tracing import traced
+from download_tokens import get_signer
+from services.book_service import BookService
+
+logger = logging.getLogger(__name__)
+
+
+def storage_key_for(file_key: Optional[str], file_url: Optional[str]) -> Optional[str]:
+    """Object key of a book's file: ``fileKey``, or derived from ``fileUrl``"""
+    if file_key:
+        return file_key
+    if file_url:
+        name = posixpath.basename(urlparse(file_url).path)
+        if name:
+            return f"books/{name}"
+    return None
+
+
+class DownloadService:
+    """Turns a download token into a short-lived storage URL.
+
+    Tokens are signed JWTs (see download_tokens), so validating one is a
+    local signature check plus a lookup in the in-memory revocation set,
+    which is reloaded from ``revoked_downloads`` every
+    DOWNLOAD_REVOCATION_REFRESH_SECONDS. The API only redirects; the file
+    itself is fetched straight from the storage backend.
+    """
+
+    def __init__(self, storage: StorageBackend, book_service: BookService,
+                 db: AsyncIOMotorDatabase = None):
+        self.storage = storage
+        self.book_service = book_service
+        self._db = db
+        self.url_ttl = int(os.getenv("DOWNLOAD_URL_TTL_SECONDS", "300"))
+        self.revocation_refresh = float(os.getenv("DOWNLOAD_REVOCATION_REFRESH_SECONDS", "60"))
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        return self._db if self._db is not None else get_database()
+
+    async def ensure_indexes(self):
+        # Only needed for links issued before tokens were signed
+        await self.db.orders.create_index("downloadLinks.downloadUrl", sparse=True)
+        await self.db.entitlements.create_index("lastDownloadLink.downloadUrl", sparse=True)
+
+    async def load_revocations(self):
+        order_ids = {doc["_id"] async for doc in self.db.revoked_downloads.find({}, {"_id": 1})}
+        get_signer().revoked = order_ids
+
+    async def revoke_order(self, order_id: str):
+        """Stop accepting download tokens issued for an order (e.g. after a refund)"""
+        await self.db.revoked_downloads.update_one(
+            {"_id": order_id},
+            {"$setOnInsert": {"revokedAt": datetime.utcnow()}},
+            upsert=True
+        )
+        get_signer().revoked.add(order_id)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.revocation_refresh)
+            try:
+                await self.load_revocations()
+            except Exception as e:
+                logger.error("Error loading download revocations: %s", e)
+
+    async def start(self):
+        try:
+            await self.load_revocations()
+        except Exception as e:
+            logger.error("Error loading download revocations: %s", e)
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    async def _find_legacy_link(self, download_url: str) -> Optional[DownloadLink]:
+        """Random, database-backed link issued before tokens were signed;
+        None if its order has been revoked"""
+        revoked = get_signer().revoked
+        order = await self.db.orders.find_one(
+            {"downloadLinks.downloadUrl": download_url},
+            {"_id": 0, "orderId": 1, "downloadLinks.$": 1}
+        )
+        if order:
+            if order["orderId"] in revoked:
+                return None
+            return DownloadLink(**order["downloadLinks"][0])
+
+        entitlement = await self.db.entitlements.find_one(
+            {"lastDownloadLink.downloadUrl": download_url},
+            {"_id": 0, "orderIds": 1, "lastDownloadLink": 1}
+        )
+        if entitlement:
+            # Still good while any order granting the book stands
+            if all(order_id in revoked for order_id in entitlement.get("orderIds", [])):
+                return None
+            return DownloadLink(**entitlement["lastDownloadLink"])
+
+        return None
+
+    async def _resolve_book_key(self, book_id: str) -> Optional[str]:
+        # Served from the catalog snapshot, so usually no database access
+        book = await self.book_service.get_cached_book(book_id)
+        if not book:
+            return None
+        return storage_key_for(book.fileKey, book.fileUrl)
+
+    @traced()
+    async def get_download_url(self, token: str) -> Optional[str]:
+        """Presigned URL for the book behind ``token``, or None if invalid/expired"""
+        claims = get_signer().verify(token)
+        if claims is not None:
+            key = await self._resolve_book_key(claims.book_id)
+        elif token.count(".") == 2:
+            # A JWT that failed verification (bad signature, expired, revoked)
+            return None
+        else:
+            link = await self._find_legacy_link(f"/api/download/{token}")
+            if not link or link.expiresAt < datetime.utcnow():
+                return None
+            key = await self._resolve_book_key(link.bookId)
+
+        if not key:
+            return None
+
+        filename = posixpath.basename(key)
+        return await self.storage.presigned_url(key, self.url_ttl, filename=filename)
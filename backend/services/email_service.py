@@ -0,0 +1,324 @@
+import os
+import uuid
+import random
+import asyncio
+import logging
+import smtplib
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, UpdateOne
+
+from models import Order, OrderStatus
+from database import get_database
+from tracing import traced
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_COLLECTION = "email_outbox"
+
+emails_sent = registry.counter("emails_sent_total", "Emails delivered to the SMTP server")
+emails_failed = registry.counter("emails_failed_total", "Email send attempts that failed")
+outbox_depth = registry.gauge("email_outbox_depth", "Emails waiting in the outbox")
+batch_size_gauge = registry.gauge("email_last_batch_size", "Emails sent in the last batch")
+
+
+def build_order_email(order: Order) -> dict:
+    """Render the post-purchase email for a delivered order"""
+    base_url = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+    lines = [
+        f"Hola {order.customer.firstName},",
+        "",
+        "¡Gracias por tu compra! Estos son tus enlaces de descarga:",
+        "",
+    ]
+    for link in order.downloadLinks:
+        lines.append(f"- {link.bookTitle}: {base_url}{link.downloadUrl}")
+    lines += [
+        "",
+        "Los enlaces caducan en 48 horas. Puedes generar nuevos desde \"Mis Compras\".",
+        "",
+        f"Número de orden: {order.orderId}",
+    ]
+    return {
+        "to": order.customer.email,
+        "subject": "Tus ebooks están listos para descargar",
+        "body": "\n".join(lines),
+    }
+
+
+def outbox_id(order_id: str) -> str:
+    return f"order-delivered:{order_id}"
+
+
+async def enqueue_order_email(db: AsyncIOMotorDatabase, order: Order):
+    """Write the post-purchase email to the outbox.
+
+    Keyed by orderId, so delivering the same order twice queues one email;
+    a re-delivery refreshes the links of an email that has not gone out yet.
+    """
+    now = datetime.utcnow()
+    await db[OUTBOX_COLLECTION].update_one(
+        {"_id": outbox_id(order.orderId)},
+        {"$set": build_order_email(order),
+         "$setOnInsert": {
+            "orderId": order.orderId,
+            "status": "pending",
+            "attempts": 0,
+            "nextAttemptAt": now,
+            "createdAt": now
+        }},
+        upsert=True
+    )
+
+
+class SMTPConnectionPool:
+    """Keeps one SMTP connection open across batches and reconnects on demand"""
+
+    def __init__(self, host: str, port: int, username: Optional[str], password: Optional[str],
+                 starttls: bool, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._connection: Optional[smtplib.SMTP] = None
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password or "")
+        return connection
+
+    def get(self) -> smtplib.SMTP:
+        if self._connection is not None:
+            try:
+                if self._connection.noop()[0] == 250:
+                    return self._connection
+            except smtplib.SMTPException:
+                pass
+            self.close()
+        self._connection = self._connect()
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._connection = None
+
+
+class EmailService:
+    """Drains the email outbox in batches over a pooled SMTP connection.
+
+    Sending is enabled when SMTP_HOST is set. For local testing run an SMTP
+    stand-in such as ``python -m aiosmtpd -n -l localhost:8025`` and set
+    SMTP_HOST=localhost, SMTP_PORT=8025, SMTP_STARTTLS=false (aiosmtpd does
+    not offer STARTTLS by default). Failed sends are retried with
+    exponential backoff up to EMAIL_MAX_ATTEMPTS, then marked ``failed``.
+    Sent and failed messages are removed by a TTL index after
+    EMAIL_RETENTION_DAYS.
+
+    Emails are queued right after an order is marked delivered, in a
+    separate write; every EMAIL_SWEEP_SECONDS a sweep queues the email for
+    orders delivered in the last EMAIL_SWEEP_LOOKBACK_HOURS that have no
+    outbox row, so a crash in between does not lose it.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase = None):
+        self._db = db
+        self.host = os.getenv("SMTP_HOST")
+        self.sender = os.getenv("EMAIL_FROM", "no-reply@mariafernandez.com")
+        self.batch_size = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+        self.poll_interval = float(os.getenv("EMAIL_POLL_SECONDS", "5"))
+        self.max_attempts = int(os.getenv("EMAIL_MAX_ATTEMPTS", "8"))
+        self.backoff_base = float(os.getenv("EMAIL_BACKOFF_SECONDS", "30"))
+        self.lease_seconds = float(os.getenv("EMAIL_LEASE_SECONDS", "120"))
+        self.retention = timedelta(days=float(os.getenv("EMAIL_RETENTION_DAYS", "30")))
+        self.sweep_interval = float(os.getenv("EMAIL_SWEEP_SECONDS", "300"))
+        self.sweep_lookback = timedelta(hours=float(os.getenv("EMAIL_SWEEP_LOOKBACK_HOURS", "24")))
+        self.worker_id = uuid.uuid4().hex
+        self.pool = SMTPConnectionPool(
+            host=self.host or "localhost",
+            port=int(os.getenv("SMTP_PORT", "587")),
+            username=os.getenv("SMTP_USERNAME"),
+            password=os.getenv("SMTP_PASSWORD"),
+            starttls=os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+        )
+        self._task: Optional[asyncio.Task] = None
+        self._depth = 0
+        outbox_depth.set_function(lambda: self._depth)
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        return self._db if self._db is not None else get_database()
+
+    @property
+    def collection(self):
+        return self.db[OUTBOX_COLLECTION]
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("status", ASCENDING), ("nextAttemptAt", ASCENDING)])
+        # Only finished (sent or failed) messages carry expireAt
+        await self.collection.create_index("expireAt", expireAfterSeconds=0)
+        await self.db.orders.create_index([("status", ASCENDING), ("updatedAt", ASCENDING)])
+
+    @traced()
+    async def sweep_delivered(self) -> int:
+        """Queue the email for recently delivered orders missing from the
+        outbox; returns how many were queued"""
+        since = datetime.utcnow() - self.sweep_lookback
+        cursor = self.db.orders.find(
+            {"status": OrderStatus.DELIVERED, "updatedAt": {"$gte": since}},
+            {"_id": 0, "orderId": 1}
+        )
+        order_ids = [order["orderId"] async for order in cursor]
+        if not order_ids:
+            return 0
+
+        queued = set(await self.collection.distinct(
+            "_id", {"_id": {"$in": [outbox_id(order_id) for order_id in order_ids]}}
+        ))
+        missing = [order_id for order_id in order_ids if outbox_id(order_id) not in queued]
+        if not missing:
+            return 0
+
+        async for document in self.db.orders.find({"orderId": {"$in": missing}}):
+            document["_id"] = str(document["_id"])
+            await enqueue_order_email(self.db, Order(**document))
+        logger.warning("Queued %s post-purchase emails missing from the outbox", len(missing))
+        return len(missing)
+
+    async def _claim_batch(self) -> List[dict]:
+        """Lease up to batch_size due messages to this worker"""
+        now = datetime.utcnow()
+        due = {
+            "$or": [
+                {"status": "pending", "nextAttemptAt": {"$lte": now}},
+                {"status": "sending", "leaseUntil": {"$lt": now}},
+            ]
+        }
+        cursor = self.collection.find(due, {"_id": 1}).sort("nextAttemptAt", 1).limit(self.batch_size)
+        ids = [doc["_id"] for doc in await cursor.to_list(length=self.batch_size)]
+        if not ids:
+            return []
+
+        claim = f"{self.worker_id}:{uuid.uuid4().hex}"
+        await self.collection.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {
+                "status": "sending",
+                "claim": claim,
+                "leaseUntil": now + timedelta(seconds=self.lease_seconds)
+            }}
+        )
+        return await self.collection.find(
+            {"_id": {"$in": ids}, "claim": claim}
+        ).to_list(length=self.batch_size)
+
+    def _send_batch(self, messages: List[dict]) -> List[Tuple[dict, Optional[str]]]:
+        """Send messages over the pooled connection (runs in a worker thread)"""
+        results = []
+        connection = None
+        for message in messages:
+            email = EmailMessage()
+            email["From"] = self.sender
+            email["To"] = message["to"]
+            email["Subject"] = message["subject"]
+            email.set_content(message["body"])
+            try:
+                # Health-check the pooled connection once per batch, not per message
+                if connection is None:
+                    connection = self.pool.get()
+                connection.send_message(email)
+                results.append((message, None))
+            except (smtplib.SMTPException, OSError) as e:
+                self.pool.close()
+                connection = None
+                results.append((message, str(e)))
+        return results
+
+    def _backoff(self, attempts: int) -> timedelta:
+        delay = min(self.backoff_base * (2 ** (attempts - 1)), 6 * 3600)
+        return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+    @traced()
+    async def drain_once(self) -> int:
+        """Send one batch; returns the number of emails delivered"""
+        messages = await self._claim_batch()
+        if not messages:
+            return 0
+
+        results = await asyncio.to_thread(self._send_batch, messages)
+
+        now = datetime.utcnow()
+        operations = []
+        sent = 0
+        for message, error in results:
+            if error is None:
+                sent += 1
+                update = {"$set": {"status": "sent", "sentAt": now, "expireAt": now + self.retention},
+                          "$unset": {"claim": "", "leaseUntil": ""}}
+            else:
+                attempts = message.get("attempts", 0) + 1
+                permanent = attempts >= self.max_attempts
+                emails_failed.inc(permanent=str(permanent).lower())
+                update = {
+                    "$set": {
+                        "status": "failed" if permanent else "pending",
+                        "attempts": attempts,
+                        "lastError": error,
+                        "nextAttemptAt": now + self._backoff(attempts)
+                    },
+                    "$unset": {"claim": "", "leaseUntil": ""}
+                }
+                if permanent:
+                    update["$set"]["expireAt"] = now + self.retention
+            operations.append(UpdateOne({"_id": message["_id"], "claim": message["claim"]}, update))
+
+        await self.collection.bulk_write(operations, ordered=False)
+        emails_sent.inc(sent)
+        batch_size_gauge.set(sent)
+        return sent
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_sweep = loop.time()
+        while True:
+            try:
+                if loop.time() >= next_sweep:
+                    next_sweep = loop.time() + self.sweep_interval
+                    await self.sweep_delivered()
+                self._depth = await self.collection.count_documents({"status": "pending"})
+                sent = await self.drain_once()
+                if sent >= self.batch_size:
+                    continue  # More may be waiting; don't sleep
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error draining email outbox: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    async def start(self):
+        await self.ensure_indexes()
+        if not self.host:
+            logger.warning("SMTP_HOST not configured - post-purchase emails stay in the outbox")
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.pool.close)
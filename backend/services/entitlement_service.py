@@ -0,0 +1,153 @@
+import logging
+from datetime import datetime
+from typing import List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, UpdateOne
+
+from models import DownloadLink, Entitlement, Order, OrderStatus
+from database import get_database
+from tracing import traced
+from events import bus, ORDER_DELIVERED
+from services.order_service import create_download_link
+from download_tokens import get_signer
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+class EntitlementService:
+    """Denormalized "what does this customer own" index.
+
+    One document per (email, bookId) in ``entitlements``, written when an
+    order is delivered. ``orderId``/``purchasedAt`` record the first purchase
+    and ``orderIds`` every order that included the book, so the library and
+    re-downloads never have to scan or validate historic orders. Orders
+    delivered before the index existed (or whose handler gave up) are added
+    with ``backfill`` (``python cli.py backfill-entitlements``).
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase = None):
+        self._db = db
+        bus.subscribe(ORDER_DELIVERED, self.on_order_delivered, background=True)
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        return self._db if self._db is not None else get_database()
+
+    @property
+    def collection(self):
+        return self.db.entitlements
+
+    async def ensure_indexes(self):
+        await self.collection.create_index(
+            [("email", ASCENDING), ("bookId", ASCENDING)], unique=True
+        )
+
+    @staticmethod
+    def _grant_operations(email: str, order_id: str, items: List[dict],
+                          purchased_at: datetime) -> List[UpdateOne]:
+        now = datetime.utcnow()
+        return [
+            UpdateOne(
+                {"email": normalize_email(email), "bookId": item["bookId"]},
+                {
+                    "$setOnInsert": {
+                        "orderId": order_id,
+                        "purchasedAt": purchased_at
+                    },
+                    "$set": {"bookTitle": item["title"], "updatedAt": now},
+                    "$addToSet": {"orderIds": order_id}
+                },
+                upsert=True
+            )
+            for item in items
+        ]
+
+    @traced()
+    async def grant_order(self, order: Order):
+        """Record every book in a delivered order as owned by its customer"""
+        operations = self._grant_operations(
+            order.customer.email, order.orderId,
+            [{"bookId": item.bookId, "title": item.title} for item in order.items],
+            datetime.utcnow()
+        )
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+
+    @traced()
+    async def backfill(self, batch_size: int = 1000) -> int:
+        """Grant the books of every delivered order; returns the orders processed.
+
+        Idempotent, so it can be re-run at any time. Orders are replayed
+        oldest first, so ``orderId``/``purchasedAt`` end up as the first
+        purchase and ``orderIds`` in purchase order.
+        """
+        cursor = self.db.orders.find(
+            {"status": OrderStatus.DELIVERED},
+            {"_id": 0, "orderId": 1, "customer.email": 1, "items.bookId": 1,
+             "items.title": 1, "createdAt": 1}
+        ).sort("createdAt", 1)
+
+        processed = 0
+        operations: List[UpdateOne] = []
+        async for order in cursor:
+            operations += self._grant_operations(
+                order["customer"]["email"], order["orderId"], order["items"], order["createdAt"]
+            )
+            processed += 1
+            if len(operations) >= batch_size:
+                # Ordered, so an order's $addToSet lands after earlier orders'
+                await self.collection.bulk_write(operations)
+                operations = []
+        if operations:
+            await self.collection.bulk_write(operations)
+
+        logger.info("Backfilled entitlements from %s delivered orders", processed)
+        return processed
+
+    async def on_order_delivered(self, order: Order, **_):
+        await self.grant_order(order)
+
+    async def _owned_documents(self, email: str, proof_order_id: str) -> Optional[List[dict]]:
+        """Entitlements for ``email``, or None if ``proof_order_id`` isn't one of its orders"""
+        cursor = self.collection.find({"email": normalize_email(email)}, {"_id": 0})
+        documents = await cursor.to_list(length=None)
+        if not any(proof_order_id in doc.get("orderIds", ()) for doc in documents):
+            return None
+        return documents
+
+    @traced()
+    async def get_library(self, email: str, proof_order_id: str) -> Optional[List[Entitlement]]:
+        """List the books a customer owns"""
+        documents = await self._owned_documents(email, proof_order_id)
+        if documents is None:
+            return None
+
+        documents.sort(key=lambda doc: doc["purchasedAt"], reverse=True)
+        return [Entitlement(**doc) for doc in documents]
+
+    @traced()
+    async def create_download_link(self, email: str, proof_order_id: str,
+                                   book_id: str) -> Optional[DownloadLink]:
+        """Mint a fresh download link for a book the customer owns"""
+        documents = await self._owned_documents(email, proof_order_id)
+        if documents is None:
+            return None
+
+        entitlement = next((doc for doc in documents if doc["bookId"] == book_id), None)
+        if entitlement is None:
+            return None
+
+        # Sign against the latest order that still grants the book, so
+        # revoking one (refunded) order doesn't cut off a later purchase
+        revoked = get_signer().revoked
+        order_id = next(
+            (order_id for order_id in reversed(entitlement.get("orderIds", [])) if order_id not in revoked),
+            None
+        )
+        if order_id is None:
+            return None
+        return create_download_link(order_id, book_id, entitlement["bookTitle"])
@@ -0,0 +1,183 @@
+import io
+import csv
+import asyncio
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from database import get_database
+
+# One row per order item; order-level fields are repeated on each row.
+EXPORT_COLUMNS = [
+    ("orderId", pa.string()),
+    ("createdAt", pa.timestamp("ms")),
+    ("updatedAt", pa.timestamp("ms")),
+    ("status", pa.string()),
+    ("customerEmail", pa.string()),
+    ("customerFirstName", pa.string()),
+    ("customerLastName", pa.string()),
+    ("customerCountry", pa.string()),
+    ("paymentIntentId", pa.string()),
+    ("paymentAmount", pa.float64()),
+    ("paymentStatus", pa.string()),
+    ("paymentMethod", pa.string()),
+    ("itemBookId", pa.string()),
+    ("itemTitle", pa.string()),
+    ("itemQuantity", pa.int64()),
+    ("itemPrice", pa.float64()),
+]
+EXPORT_FIELDS = [name for name, _ in EXPORT_COLUMNS]
+EXPORT_SCHEMA = pa.schema(EXPORT_COLUMNS)
+
+EXPORT_PROJECTION = {
+    "_id": 0,
+    "orderId": 1,
+    "createdAt": 1,
+    "updatedAt": 1,
+    "status": 1,
+    "customer": 1,
+    "paymentInfo": 1,
+    "items": 1,
+}
+
+
+def flatten_order(order: dict) -> List[dict]:
+    """Flatten an order document into one row per item"""
+    customer = order.get("customer") or {}
+    payment = order.get("paymentInfo") or {}
+    base = {
+        "orderId": order.get("orderId"),
+        "createdAt": order.get("createdAt"),
+        "updatedAt": order.get("updatedAt"),
+        "status": order.get("status"),
+        "customerEmail": customer.get("email"),
+        "customerFirstName": customer.get("firstName"),
+        "customerLastName": customer.get("lastName"),
+        "customerCountry": customer.get("country"),
+        "paymentIntentId": payment.get("paymentIntentId"),
+        "paymentAmount": payment.get("amount"),
+        "paymentStatus": payment.get("status"),
+        "paymentMethod": payment.get("paymentMethod"),
+    }
+    items = order.get("items") or [{}]
+    return [
+        {
+            **base,
+            "itemBookId": item.get("bookId"),
+            "itemTitle": item.get("title"),
+            "itemQuantity": item.get("quantity"),
+            "itemPrice": item.get("price"),
+        }
+        for item in items
+    ]
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class OrderExportService:
+    """Streams orders for accounting without materializing Order models.
+
+    Rows come from an async cursor with a projection and are emitted in
+    fixed-size chunks, so memory use is bounded by ``chunk_rows`` regardless
+    of how many orders fall in the date range.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase = None, batch_size: int = 1000):
+        self._db = db
+        self.batch_size = batch_size
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        return self._db if self._db is not None else get_database()
+
+    @property
+    def collection(self):
+        return self.db.orders
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("createdAt")
+
+    async def iter_row_chunks(self, start: datetime, end: Optional[datetime] = None,
+                              chunk_rows: int = 5000) -> AsyncIterator[List[dict]]:
+        """Yield flattened rows for orders created in [start, end), in chunks"""
+        query: Dict[str, dict] = {"createdAt": {"$gte": start}}
+        if end is not None:
+            query["createdAt"]["$lt"] = end
+
+        cursor = (
+            self.collection.find(query, EXPORT_PROJECTION)
+            .sort("createdAt", 1)
+            .batch_size(self.batch_size)
+        )
+
+        rows: List[dict] = []
+        async for order in cursor:
+            rows.extend(flatten_order(order))
+            if len(rows) >= chunk_rows:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    async def stream_csv(self, start: datetime, end: Optional[datetime] = None,
+                         chunk_rows: int = 5000) -> AsyncIterator[bytes]:
+        """Stream the export as UTF-8 CSV"""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+
+        async for rows in self.iter_row_chunks(start, end, chunk_rows):
+            writer.writerows(rows)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+        remaining = buffer.getvalue()
+        if remaining:
+            yield remaining.encode("utf-8")
+
+    @staticmethod
+    def _write_row_group(writer: pq.ParquetWriter, rows: List[dict]):
+        writer.write_table(pa.Table.from_pylist(rows, schema=EXPORT_SCHEMA))
+
+    async def stream_parquet(self, start: datetime, end: Optional[datetime] = None,
+                             chunk_rows: int = 50000) -> AsyncIterator[bytes]:
+        """Stream the export as Parquet, one row group per chunk"""
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, EXPORT_SCHEMA, compression="snappy")
+        try:
+            async for rows in self.iter_row_chunks(start, end, chunk_rows):
+                # Encoding is CPU-bound; keep it off the event loop
+                await asyncio.to_thread(self._write_row_group, writer, rows)
+                data = sink.drain()
+                if data:
+                    yield data
+        finally:
+            writer.close()
+        yield sink.drain()
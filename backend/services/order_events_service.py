@@ -0,0 +1,149 @@
+import os
+import json
+import asyncio
+import logging
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Optional, Set
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from models import Order, OrderStatus, PaymentStatus
+from database import get_database
+from metrics import registry
+from events import bus, ORDER_UPDATED
+
+logger = logging.getLogger(__name__)
+
+subscribers_gauge = registry.gauge(
+    "order_event_subscribers", "Open order status event streams"
+)
+
+# No further updates are expected once an order reaches one of these
+TERMINAL_STATUSES = {OrderStatus.DELIVERED, OrderStatus.FAILED}
+
+
+def order_event(order: Order) -> dict:
+    """What an order status stream sends: status, payment status and links"""
+    return {
+        "orderId": order.orderId,
+        "status": order.status,
+        "paymentStatus": order.paymentInfo.status,
+        "downloadLinks": [link.model_dump(mode="json") for link in order.downloadLinks]
+    }
+
+
+def format_sse(data: dict, event: str = "order") -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def is_finished(order: Order) -> bool:
+    return order.status in TERMINAL_STATUSES or order.paymentInfo.status == PaymentStatus.FAILED
+
+
+class OrderEventsService:
+    """Fans order changes out to server-sent event streams.
+
+    Each stream registers a one-slot queue per order; every change replaces
+    the queued state, so slow clients only ever get the latest one. With
+    ORDER_EVENTS_SOURCE=local (default) changes come from ORDER_UPDATED on
+    the in-process event bus, which only sees writes made by this worker.
+    With ORDER_EVENTS_SOURCE=changestream each worker watches the ``orders``
+    collection once instead (needs a replica set), so streams see writes
+    from any worker.
+
+    Streams are exempt from admission control (they stay open for up to
+    ORDER_EVENTS_MAX_SECONDS) and capped separately per worker by
+    ORDER_EVENTS_MAX_STREAMS.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase = None):
+        self._db = db
+        self.source = os.getenv("ORDER_EVENTS_SOURCE", "local").lower()
+        self.heartbeat = float(os.getenv("ORDER_EVENTS_HEARTBEAT_SECONDS", "15"))
+        self.max_duration = float(os.getenv("ORDER_EVENTS_MAX_SECONDS", "900"))
+        self.max_streams = int(os.getenv("ORDER_EVENTS_MAX_STREAMS", "1000"))
+        self._open_streams = 0
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._watch_task: Optional[asyncio.Task] = None
+
+        subscribers_gauge.set_function(lambda: self._open_streams)
+        if self.source != "changestream":
+            bus.subscribe(ORDER_UPDATED, self.on_order_updated)
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        return self._db if self._db is not None else get_database()
+
+    def at_capacity(self) -> bool:
+        return self._open_streams >= self.max_streams
+
+    def subscribe(self, order_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers[order_id].add(queue)
+        self._open_streams += 1
+        return queue
+
+    def unsubscribe(self, order_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(order_id)
+        if queues is None or queue not in queues:
+            return
+        queues.discard(queue)
+        self._open_streams -= 1
+        if not queues:
+            del self._subscribers[order_id]
+
+    def notify(self, order: Order):
+        for queue in self._subscribers.get(order.orderId, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(order)
+
+    async def on_order_updated(self, order: Order, **_):
+        self.notify(order)
+
+    async def stream(self, queue: asyncio.Queue, order: Order) -> AsyncIterator[str]:
+        """SSE body: the current state, then every change until the order is
+        delivered or failed (or ORDER_EVENTS_MAX_SECONDS pass)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_duration
+        try:
+            yield f"retry: 3000\n{format_sse(order_event(order))}"
+            while not is_finished(order):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    order = await asyncio.wait_for(queue.get(), timeout=min(self.heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(order_event(order))
+        finally:
+            self.unsubscribe(order.orderId, queue)
+
+    async def _watch(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["update", "replace"]}}}]
+        while True:
+            try:
+                async with self.db.orders.watch(pipeline, full_document="updateLookup") as changes:
+                    async for change in changes:
+                        document = change.get("fullDocument")
+                        # Only validate orders someone is listening to
+                        if not document or document.get("orderId") not in self._subscribers:
+                            continue
+                        document["_id"] = str(document["_id"])
+                        self.notify(Order(**document))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Order change stream failed, retrying: %s", e)
+                await asyncio.sleep(5)
+
+    async def start(self):
+        if self.source == "changestream":
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
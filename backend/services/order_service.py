@@ -1,19 +1,56 @@
 from typing import List, Optional
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from datetime import datetime, timedelta
+from datetime import datetime
 import uuid
-import secrets
+import logging
 
 from models import Order, OrderCreate, OrderStatus, PaymentStatus, DownloadLink
 from database import get_database
+from tracing import traced, span
+from events import bus, ORDER_DELIVERED, ORDER_UPDATED
+from coalescing import SingleFlight
+from download_tokens import get_signer
+from services.email_service import enqueue_order_email
+
+logger = logging.getLogger(__name__)
+
+
+def create_download_link(order_id: str, book_id: str, book_title: str) -> DownloadLink:
+    """Mint a signed download link for a book (valid for 48 hours by default)"""
+    token, expires_at = get_signer().issue(order_id, book_id)
+    
+    return DownloadLink(
+        bookId=book_id,
+        bookTitle=book_title,
+        downloadUrl=f"/api/download/{token}",
+        expiresAt=expires_at
+    )
 
 
 class OrderService:
     def __init__(self, db: AsyncIOMotorDatabase = None):
-        self.db = db or get_database()
-        self.collection = self.db.orders
+        self._db = db
+        # Concurrent get_order_by_id calls for one order share a single query
+        self._flight = SingleFlight("orders")
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        # Resolved lazily: services are created at import time, before
+        # connect_to_mongo() has run.
+        return self._db if self._db is not None else get_database()
+
+    @property
+    def collection(self):
+        return self.db.orders
+
+    def _to_order(self, order_data: dict) -> Order:
+        """Validate a raw MongoDB document into an Order"""
+        order_data['_id'] = str(order_data['_id'])
+        with span("Order.validate"):
+            return Order(**order_data)
 
+    @traced()
     async def create_order(self, order_create: OrderCreate) -> Order:
         """Create a new order"""
         order_data = {
@@ -35,16 +72,24 @@ class OrderService:
         
         return Order(**order_data)
 
+    @traced()
     async def get_order_by_id(self, order_id: str) -> Optional[Order]:
         """Get order by orderId (not MongoDB _id)"""
+        return await self._flight.do(order_id, lambda: self._find_order(order_id))
+
+    def forget(self, order_id: str):
+        """Call after writing to an order outside this service"""
+        self._flight.forget(order_id)
+
+    async def _find_order(self, order_id: str) -> Optional[Order]:
         order_data = await self.collection.find_one({"orderId": order_id})
         
         if order_data:
-            order_data['_id'] = str(order_data['_id'])
-            return Order(**order_data)
+            return self._to_order(order_data)
         
         return None
 
+    @traced()
     async def get_order_by_mongodb_id(self, mongodb_id: str) -> Optional[Order]:
         """Get order by MongoDB _id"""
         if not ObjectId.is_valid(mongodb_id):
@@ -53,11 +98,11 @@ class OrderService:
         order_data = await self.collection.find_one({"_id": ObjectId(mongodb_id)})
         
         if order_data:
-            order_data['_id'] = str(order_data['_id'])
-            return Order(**order_data)
+            return self._to_order(order_data)
         
         return None
 
+    @traced()
     async def get_orders_by_email(self, email: str) -> List[Order]:
         """Get all orders for a customer by email"""
         cursor = self.collection.find({"customer.email": email})
@@ -65,11 +110,11 @@ class OrderService:
         
         orders = []
         for order_data in orders_data:
-            order_data['_id'] = str(order_data['_id'])
-            orders.append(Order(**order_data))
+            orders.append(self._to_order(order_data))
         
         return orders
 
+    @traced()
     async def update_order_status(self, order_id: str, status: OrderStatus) -> Optional[Order]:
         """Update order status"""
         update_data = {
@@ -82,13 +127,17 @@ class OrderService:
             {"$set": update_data},
             return_document=True
         )
+        # Reads already in flight may predate the write; don't let new callers join them
+        self._flight.forget(order_id)
         
         if result:
-            result['_id'] = str(result['_id'])
-            return Order(**result)
+            order = self._to_order(result)
+            await bus.publish(ORDER_UPDATED, order=order)
+            return order
         
         return None
 
+    @traced()
     async def update_payment_info(self, order_id: str, payment_intent_id: str, status: PaymentStatus) -> Optional[Order]:
         """Update payment information"""
         update_data = {
@@ -102,13 +151,40 @@ class OrderService:
             {"$set": update_data},
             return_document=True
         )
+        self._flight.forget(order_id)
+        
+        if result:
+            order = self._to_order(result)
+            await bus.publish(ORDER_UPDATED, order=order)
+            return order
+        
+        return None
+
+    @traced()
+    async def save_payment_intent(self, order_id: str, payment_intent_id: str,
+                                  client_secret: str, amount_cents: int) -> Optional[Order]:
+        """Record the order's current PaymentIntent so later attempts can reuse it"""
+        update_data = {
+            "paymentInfo.paymentIntentId": payment_intent_id,
+            "paymentInfo.clientSecret": client_secret,
+            "paymentInfo.intentAmountCents": amount_cents,
+            "paymentInfo.status": PaymentStatus.PENDING,
+            "updatedAt": datetime.utcnow()
+        }
+        
+        result = await self.collection.find_one_and_update(
+            {"orderId": order_id},
+            {"$set": update_data},
+            return_document=True
+        )
+        self._flight.forget(order_id)
         
         if result:
-            result['_id'] = str(result['_id'])
-            return Order(**result)
+            return self._to_order(result)
         
         return None
 
+    @traced()
     async def generate_download_links(self, order_id: str) -> Optional[Order]:
         """Generate secure download links for purchased books"""
         order = await self.get_order_by_id(order_id)
@@ -116,20 +192,9 @@ class OrderService:
             return None
 
         # Generate download links for each book
-        download_links = []
-        for item in order.items:
-            # Generate secure download token
-            download_token = secrets.token_urlsafe(32)
-            # Links expire in 48 hours
-            expires_at = datetime.utcnow() + timedelta(hours=48)
-            
-            download_link = DownloadLink(
-                bookId=item.bookId,
-                bookTitle=item.title,
-                downloadUrl=f"/api/download/{download_token}",
-                expiresAt=expires_at
-            )
-            download_links.append(download_link)
+        download_links = [
+            create_download_link(order_id, item.bookId, item.title) for item in order.items
+        ]
 
         # Update order with download links
         update_data = {
@@ -143,13 +208,23 @@ class OrderService:
             {"$set": update_data},
             return_document=True
         )
+        self._flight.forget(order_id)
         
         if result:
-            result['_id'] = str(result['_id'])
-            return Order(**result)
+            delivered_order = self._to_order(result)
+            await bus.publish(ORDER_DELIVERED, order=delivered_order)
+            await bus.publish(ORDER_UPDATED, order=delivered_order)
+            # Queue the post-purchase email; EmailService sends it in the
+            # background and its sweep re-queues it if this write fails
+            try:
+                await enqueue_order_email(self.db, delivered_order)
+            except Exception as e:
+                logger.error("Error queueing email for order %s: %s", order_id, e)
+            return delivered_order
         
         return None
 
+    @traced()
     async def get_order_stats(self) -> dict:
         """Get order statistics"""
         total_orders = await self.collection.count_documents({})
@@ -179,6 +254,7 @@ class OrderService:
             "totalRevenue": round(total_revenue, 2)
         }
 
+    @traced()
     async def get_recent_orders(self, limit: int = 10) -> List[Order]:
         """Get recent orders"""
         cursor = self.collection.find({}).sort("createdAt", -1).limit(limit)
@@ -186,7 +262,6 @@ class OrderService:
         
         orders = []
         for order_data in orders_data:
-            order_data['_id'] = str(order_data['_id'])
-            orders.append(Order(**order_data))
+            orders.append(self._to_order(order_data))
         
         return orders
\ No newline at end of file
@@ -0,0 +1,240 @@
+import os
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+from bson import ObjectId
+from scipy import sparse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from models import Book, Order, OrderStatus
+from database import get_database
+from tracing import traced
+from events import bus, ORDER_DELIVERED
+from services.book_service import BookService
+
+logger = logging.getLogger(__name__)
+
+# Order _ids per update_many when a rebuild marks what it counted
+MARK_BATCH_SIZE = 1000
+
+
+def order_basket(book_ids: Iterable[str]) -> List[str]:
+    """Distinct canonical book ids of an order; anything that is not an
+    ObjectId is dropped, since it would be spliced into a ``counts.<id>`` path"""
+    return sorted({str(ObjectId(book_id)) for book_id in book_ids if ObjectId.is_valid(book_id)})
+
+
+def cooccurrence_matrix(baskets: Sequence[Sequence[str]]) -> Tuple[List[str], sparse.csr_matrix]:
+    """Book ids and their book x book co-purchase counts (zero diagonal)"""
+    book_ids = sorted({book_id for basket in baskets for book_id in basket})
+    index = {book_id: i for i, book_id in enumerate(book_ids)}
+
+    rows, cols = [], []
+    for row, basket in enumerate(baskets):
+        for book_id in set(basket):
+            rows.append(row)
+            cols.append(index[book_id])
+
+    # Basket x book incidence matrix; B.T @ B counts baskets containing both books
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+        shape=(len(baskets), len(book_ids))
+    )
+    counts = (incidence.T @ incidence).tocsr()
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    return book_ids, counts
+
+
+def top_neighbours(counts: Dict[str, int], top_n: int) -> List[dict]:
+    """Highest co-purchase counts first, ties broken by book id"""
+    best = heapq.nsmallest(top_n, counts.items(), key=lambda item: (-item[1], item[0]))
+    return [{"bookId": book_id, "score": int(score)} for book_id, score in best if score > 0]
+
+
+class RecommendationService:
+    """"Customers also bought" lists, precomputed per book.
+
+    ``book_recommendations`` holds one document per book with its raw
+    co-purchase ``counts`` and the top RECOMMENDATIONS_TOP_N ``related``
+    books. ``rebuild`` recomputes everything from delivered orders with a
+    sparse matrix product (run it as a batch job, see cli.py); delivered
+    orders are then folded in incrementally, so serving related books is a
+    single document read (plus one $in for the books themselves).
+
+    Orders folded in are flagged ``copurchaseCounted``. While a rebuild
+    holds its lock (``recommendation_state``), deliveries are left
+    unflagged instead of racing its overwrites, and the rebuild folds them
+    in once it is done; ``catch_up`` does the same for deliveries whose
+    handler failed for good.
+    """
+
+    def __init__(self, book_service: BookService, db: AsyncIOMotorDatabase = None):
+        self.book_service = book_service
+        self._db = db
+        self.top_n = int(os.getenv("RECOMMENDATIONS_TOP_N", "10"))
+        self.lock_ttl = timedelta(hours=float(os.getenv("RECOMMENDATIONS_LOCK_HOURS", "1")))
+        bus.subscribe(ORDER_DELIVERED, self.on_order_delivered, background=True)
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        return self._db if self._db is not None else get_database()
+
+    @property
+    def collection(self):
+        return self.db.book_recommendations
+
+    @property
+    def state(self):
+        return self.db.recommendation_state
+
+    async def _rebuild_running(self) -> bool:
+        lock = await self.state.find_one({"_id": "rebuild", "lockedUntil": {"$gt": datetime.utcnow()}})
+        return lock is not None
+
+    @traced()
+    async def rebuild(self) -> int:
+        """Recompute all co-purchase counts from delivered orders; returns 0
+        without doing anything if another rebuild holds the lock"""
+        started_at = datetime.utcnow()
+        try:
+            # Matches only a free or expired lock; otherwise the upsert collides on _id
+            await self.state.update_one(
+                {"_id": "rebuild", "$or": [
+                    {"lockedUntil": {"$lt": started_at}},
+                    {"lockedUntil": {"$exists": False}},
+                ]},
+                {"$set": {"startedAt": started_at, "lockedUntil": started_at + self.lock_ttl}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            logger.warning("Recommendations rebuild already running, skipping")
+            return 0
+        try:
+            books = await self._rebuild(started_at)
+        finally:
+            await self.state.update_one(
+                {"_id": "rebuild", "startedAt": started_at},
+                {"$set": {"lockedUntil": datetime.utcnow()}}
+            )
+        # Deliveries skipped while the lock was held
+        await self.catch_up()
+        return books
+
+    async def _rebuild(self, started_at: datetime) -> int:
+        cursor = self.db.orders.find({"status": OrderStatus.DELIVERED}, {"items.bookId": 1})
+        scanned, baskets = [], []
+        async for order in cursor:
+            scanned.append(order["_id"])
+            baskets.append(order_basket(item["bookId"] for item in order["items"]))
+        book_ids, counts = cooccurrence_matrix(baskets)
+
+        operations = []
+        for i, book_id in enumerate(book_ids):
+            start, end = counts.indptr[i], counts.indptr[i + 1]
+            row = {
+                book_ids[j]: int(value)
+                for j, value in zip(counts.indices[start:end], counts.data[start:end])
+            }
+            operations.append(ReplaceOne(
+                {"_id": book_id},
+                {"counts": row, "related": top_neighbours(row, self.top_n), "updatedAt": started_at},
+                upsert=True
+            ))
+
+        await self.collection.delete_many({"_id": {"$nin": book_ids}})
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+        # Mark exactly what the rebuild counted so incremental updates skip it
+        for start in range(0, len(scanned), MARK_BATCH_SIZE):
+            await self.db.orders.update_many(
+                {"_id": {"$in": scanned[start:start + MARK_BATCH_SIZE]}},
+                {"$set": {"copurchaseCounted": True}}
+            )
+
+        logger.info("Rebuilt recommendations for %s books from %s orders", len(book_ids), len(baskets))
+        return len(book_ids)
+
+    @traced()
+    async def catch_up(self) -> int:
+        """Fold in delivered orders no rebuild or handler has counted yet"""
+        cursor = self.db.orders.find(
+            {"status": OrderStatus.DELIVERED, "copurchaseCounted": {"$ne": True}},
+            {"_id": 0, "orderId": 1, "items.bookId": 1}
+        )
+        folded = 0
+        async for order in cursor:
+            book_ids = order_basket(item["bookId"] for item in order["items"])
+            if await self._fold(order["orderId"], book_ids):
+                folded += 1
+        if folded:
+            logger.info("Folded %s uncounted orders into recommendations", folded)
+        return folded
+
+    @traced()
+    async def add_order(self, order: Order):
+        """Fold one delivered order into the co-purchase counts"""
+        # A running rebuild would overwrite the increments; it folds the order in afterwards
+        if await self._rebuild_running():
+            return
+        await self._fold(order.orderId, basket(item.bookId for item in order.items))
+
+    async def _fold(self, order_id: str, book_ids: List[str]) -> bool:
+        """Claim an order and add its pairs to the counts; False if already counted"""
+        # Count each order once, even if it is delivered again
+        claimed = await self.db.orders.update_one(
+            {"orderId": order_id, "copurchaseCounted": {"$ne": True}},
+            {"$set": {"copurchaseCounted": True}}
+        )
+        if claimed.modified_count == 0:
+            return False
+        if len(book_ids) < 2:
+            return True
+
+        try:
+            await self._increment(book_ids)
+        except Exception:
+            # Release the claim so a retry (or catch_up) counts the order
+            await self.db.orders.update_one({"orderId": order_id}, {"$unset": {"copurchaseCounted": ""}})
+            raise
+        return True
+
+    async def _increment(self, book_ids: List[str]):
+        now = datetime.utcnow()
+        await self.collection.bulk_write([
+            UpdateOne(
+                {"_id": book_id},
+                {
+                    "$inc": {f"counts.{other}": 1 for other in book_ids if other != book_id},
+                    "$set": {"updatedAt": now}
+                },
+                upsert=True
+            )
+            for book_id in book_ids
+        ], ordered=False)
+
+        cursor = self.collection.find({"_id": {"$in": book_ids}}, {"counts": 1})
+        await self.collection.bulk_write([
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"related": top_neighbours(doc["counts"], self.top_n)}})
+            async for doc in cursor
+        ], ordered=False)
+
+    async def on_order_delivered(self, order: Order, **_):
+        await self.add_order(order)
+
+    @traced()
+    async def get_related_books(self, book_id: str) -> List[Book]:
+        """Books most often bought together with ``book_id``"""
+        doc = await self.collection.find_one({"_id": book_id}, {"_id": 0, "related": 1})
+        if not doc or not doc.get("related"):
+            return []
+
+        related_ids = [entry["bookId"] for entry in doc["related"]]
+        books = await self.book_service.get_books_by_ids(related_ids)
+        # Keep the ranking; books deleted since the last update are skipped
+        return [books[related_id] for related_id in related_ids if related_id in books]
@@ -0,0 +1,160 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from models import OrderStatus, PaymentStatus
+from database import get_database
+from tracing import traced
+from events import bus, ORDER_UPDATED
+from services.order_service import OrderService
+from services.stripe_service import StripeService, to_cents
+
+logger = logging.getLogger(__name__)
+
+
+class ReconciliationService:
+    """Settles orders left pending because the client never confirmed.
+
+    Instead of one PaymentIntent.retrieve per order, PaymentIntents created
+    in the window are listed page by page (100 per call) and matched to
+    pending orders through ``metadata.order_id``. Orders with a succeeded
+    intent for the full amount are marked paid and delivered; orders whose
+    current intent was canceled are marked failed. Everything else is left
+    pending for a later run. Paid orders whose delivery failed (on an
+    earlier run or in /api/payments/confirm) are delivered again on every
+    run until it succeeds.
+    """
+
+    def __init__(self, stripe_service: StripeService, order_service: OrderService,
+                 db: AsyncIOMotorDatabase = None):
+        self.stripe_service = stripe_service
+        self.order_service = order_service
+        self._db = db
+        # Intents can be created a while after their order
+        self.slack = timedelta(hours=float(os.getenv("RECONCILE_INTENT_SLACK_HOURS", "24")))
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        return self._db if self._db is not None else get_database()
+
+    @traced()
+    async def reconcile(self, start: datetime, end: Optional[datetime] = None) -> dict:
+        """Reconcile pending (and paid but undelivered) orders created in [start, end)"""
+        end = end or datetime.utcnow()
+        report = {"pendingOrders": 0, "undeliveredOrders": 0, "intentsScanned": 0,
+                  "pagesFetched": 0, "settled": 0, "failed": 0, "amountMismatch": 0,
+                  "stillPending": 0, "delivered": 0, "deliveryFailed": 0}
+
+        cursor = self.db.orders.find(
+            {
+                "createdAt": {"$gte": start, "$lt": end},
+                "$or": [
+                    {"paymentInfo.status": PaymentStatus.PENDING},
+                    {"paymentInfo.status": PaymentStatus.COMPLETED, "status": {"$ne": OrderStatus.DELIVERED}},
+                ]
+            },
+            {"_id": 0, "orderId": 1, "paymentInfo": 1}
+        )
+        pending: Dict[str, dict] = {}
+        undelivered: List[str] = []
+        async for order in cursor:
+            if order["paymentInfo"]["status"] == PaymentStatus.PENDING:
+                pending[order["orderId"]] = order
+            else:
+                undelivered.append(order["orderId"])
+        report["pendingOrders"] = len(pending)
+        report["undeliveredOrders"] = len(undelivered)
+        if not pending and not undelivered:
+            return report
+
+        settle: Dict[str, str] = {}
+        fail: Dict[str, str] = {}
+        if pending:
+            async for page in self.stripe_service.list_payment_intents(start, end + self.slack):
+                report["pagesFetched"] += 1
+                report["intentsScanned"] += len(page)
+                for intent in page:
+                    order_id = (intent.metadata or {}).get("order_id")
+                    order = pending.get(order_id)
+                    if order is None or order_id in settle:
+                        continue
+
+                    payment = order["paymentInfo"]
+                    if intent.status == "succeeded":
+                        if intent.amount < to_cents(payment["amount"]):
+                            report["amountMismatch"] += 1
+                            logger.warning("Payment intent %s for order %s is below the order amount",
+                                           intent.id, order_id)
+                            continue
+                        settle[order_id] = intent.id
+                        fail.pop(order_id, None)
+                    elif intent.status == "canceled" and intent.id == payment.get("paymentIntentId"):
+                        fail[order_id] = intent.id
+
+        now = datetime.utcnow()
+        # Separate requests, so each outcome is counted from what actually matched
+        if settle:
+            result = await self.db.orders.bulk_write([
+                UpdateOne(
+                    {"orderId": order_id, "paymentInfo.status": PaymentStatus.PENDING},
+                    {"$set": {
+                        "paymentInfo.paymentIntentId": intent_id,
+                        "paymentInfo.status": PaymentStatus.COMPLETED,
+                        "updatedAt": now
+                    }}
+                )
+                for order_id, intent_id in settle.items()
+            ], ordered=False)
+            report["settled"] = result.matched_count
+        if fail:
+            result = await self.db.orders.bulk_write([
+                UpdateOne(
+                    {"orderId": order_id, "paymentInfo.status": PaymentStatus.PENDING},
+                    {
+                        "$set": {
+                            "paymentInfo.status": PaymentStatus.FAILED,
+                            "status": OrderStatus.FAILED,
+                            "updatedAt": now
+                        },
+                        # The canceled intent's cached secret must not be handed out again
+                        "$unset": {"paymentInfo.clientSecret": "", "paymentInfo.intentAmountCents": ""}
+                    }
+                )
+                for order_id in fail
+            ], ordered=False)
+            report["failed"] = result.matched_count
+        for order_id in list(settle) + list(fail):
+            self.order_service.forget(order_id)
+
+        untouched = [order_id for order_id in pending if order_id not in settle and order_id not in fail]
+        if untouched:
+            report["stillPending"] = await self.db.orders.count_documents(
+                {"orderId": {"$in": untouched}, "paymentInfo.status": PaymentStatus.PENDING}
+            )
+
+        for order_id in fail:
+            order = await self.order_service.get_order_by_id(order_id)
+            if order:
+                await bus.publish(ORDER_UPDATED, order=order)
+
+        # Same follow-up as /api/payments/confirm: links, email and entitlements
+        for order_id in list(settle) + undelivered:
+            try:
+                delivered = await self.order_service.generate_download_links(order_id)
+            except Exception as e:
+                logger.error("Error delivering reconciled order %s: %s", order_id, e)
+                delivered = None
+            if delivered:
+                report["delivered"] += 1
+            else:
+                report["deliveryFailed"] += 1
+
+        logger.info("Reconciled %s pending and %s undelivered orders: %s settled, %s failed, "
+                    "%s still pending, %s delivered, %s delivery failures (%s Stripe calls)",
+                    report["pendingOrders"], report["undeliveredOrders"], report["settled"],
+                    report["failed"], report["stillPending"], report["delivered"],
+                    report["deliveryFailed"], report["pagesFetched"])
+        return report
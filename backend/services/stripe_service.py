@@ -1,12 +1,44 @@
 import os
+import asyncio
 import stripe
-from typing import Optional
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional
 import logging
 
+from models import Order
+from metrics import registry
+from tracing import traced, span
+from resilience import Bulkhead, CircuitBreaker, ServiceUnavailableError, guarded
+
 logger = logging.getLogger(__name__)
 
+payment_intents_counter = registry.counter(
+    "payment_intents_total", "create-intent requests by outcome (reused, updated, created, paid)"
+)
+
 # Configure Stripe
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "sk_test_dummy_key")
+# Fail fast at the HTTP level too; retries are left to the circuit breaker
+stripe.max_network_retries = 0
+stripe.default_http_client = stripe.new_default_http_client(
+    timeout=float(os.getenv("STRIPE_TIMEOUT", "10"))
+)
+
+
+def to_cents(amount: float) -> int:
+    # round(), not int(): 19.99 * 100 == 1998.9999999999998
+    return round(amount * 100)
+
+
+def _is_stripe_outage(error: BaseException) -> bool:
+    """Errors that say Stripe itself is unhealthy, as opposed to a bad request"""
+    return isinstance(error, (
+        asyncio.TimeoutError,
+        stripe.error.APIConnectionError,
+        stripe.error.APIError,
+        stripe.error.RateLimitError,
+    ))
+
 
 class StripeService:
     def __init__(self):
@@ -14,22 +46,66 @@ class StripeService:
         if self.api_key == "sk_test_dummy_key":
             logger.warning("Using dummy Stripe key - payments will not work in production")
 
-    async def create_payment_intent(self, amount: float, order_id: str, customer_email: str) -> dict:
+        # Point the SDK at a local stand-in such as stripe-mock (http://localhost:12111)
+        api_base = os.getenv("STRIPE_API_BASE")
+        if api_base:
+            stripe.api_base = api_base
+            logger.info("Using Stripe API base %s", api_base)
+
+        self.timeout = float(os.getenv("STRIPE_TIMEOUT", "10"))
+        self.circuit_breaker = CircuitBreaker(
+            "stripe",
+            failure_rate=float(os.getenv("STRIPE_BREAKER_FAILURE_RATE", "0.5")),
+            min_calls=int(os.getenv("STRIPE_BREAKER_MIN_CALLS", "10")),
+            window=float(os.getenv("STRIPE_BREAKER_WINDOW", "30")),
+            open_seconds=float(os.getenv("STRIPE_BREAKER_OPEN_SECONDS", "30")),
+            half_open_calls=int(os.getenv("STRIPE_BREAKER_HALF_OPEN_CALLS", "3"))
+        )
+        self.bulkhead = Bulkhead(
+            "stripe",
+            max_concurrent=int(os.getenv("STRIPE_MAX_CONCURRENCY", "20")),
+            max_wait=float(os.getenv("STRIPE_BULKHEAD_WAIT", "0.1"))
+        )
+
+    async def _call(self, func, *args, **kwargs):
+        """Run a blocking Stripe SDK call off the event loop, behind the
+        circuit breaker and bulkhead.
+
+        Raises ServiceUnavailableError when the call is shed. A call that
+        times out keeps running in its thread, so it keeps its bulkhead
+        permit until the thread returns.
+        """
+        try:
+            async with guarded(self.circuit_breaker, self.bulkhead, is_failure=_is_stripe_outage) as permit:
+                work = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+                permit.hold_until(work)
+                return await asyncio.wait_for(asyncio.shield(work), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise ServiceUnavailableError(
+                "Stripe request timed out", self.circuit_breaker.retry_after()
+            )
+
+    @traced()
+    async def create_payment_intent(self, amount: float, order_id: str, customer_email: str,
+                                    idempotency_key: Optional[str] = None) -> dict:
         """Create a Stripe PaymentIntent"""
         try:
             # Convert amount to cents (Stripe uses cents)
-            amount_cents = int(amount * 100)
+            amount_cents = to_cents(amount)
             
-            payment_intent = stripe.PaymentIntent.create(
-                amount=amount_cents,
-                currency='usd',
-                metadata={
-                    'order_id': order_id,
-                    'customer_email': customer_email
-                },
-                receipt_email=customer_email,
-                description=f"Compra de ebooks - Orden #{order_id}"
-            )
+            with span("stripe.PaymentIntent.create", order_id=order_id, amount_cents=amount_cents):
+                payment_intent = await self._call(
+                    stripe.PaymentIntent.create,
+                    amount=amount_cents,
+                    currency='usd',
+                    metadata={
+                        'order_id': order_id,
+                        'customer_email': customer_email
+                    },
+                    receipt_email=customer_email,
+                    description=f"Compra de ebooks - Orden #{order_id}",
+                    idempotency_key=idempotency_key
+                )
             
             return {
                 "success": True,
@@ -38,8 +114,10 @@ class StripeService:
                 "amount": amount
             }
             
+        except ServiceUnavailableError:
+            raise
         except stripe.error.StripeError as e:
-            logger.error(f"Stripe error creating payment intent: {e}")
+            logger.error("Stripe error creating payment intent: %s", e)
             return {
                 "success": False,
                 "error": str(e),
@@ -47,7 +125,7 @@ class StripeService:
                 "paymentIntentId": None
             }
         except Exception as e:
-            logger.error(f"Unexpected error creating payment intent: {e}")
+            logger.error("Unexpected error creating payment intent: %s", e)
             return {
                 "success": False,
                 "error": "Error interno del servidor",
@@ -55,10 +133,148 @@ class StripeService:
                 "paymentIntentId": None
             }
 
+    @traced()
+    async def update_payment_intent_amount(self, payment_intent_id: str, amount: float,
+                                           idempotency_key: Optional[str] = None) -> dict:
+        """Change the amount of an existing PaymentIntent in place"""
+        try:
+            amount_cents = to_cents(amount)
+            
+            with span("stripe.PaymentIntent.modify", payment_intent_id=payment_intent_id,
+                      amount_cents=amount_cents):
+                payment_intent = await self._call(
+                    stripe.PaymentIntent.modify,
+                    payment_intent_id,
+                    amount=amount_cents,
+                    idempotency_key=idempotency_key
+                )
+            
+            return {
+                "success": True,
+                "clientSecret": payment_intent.client_secret,
+                "paymentIntentId": payment_intent.id,
+                "amount": amount
+            }
+            
+        except ServiceUnavailableError:
+            raise
+        except stripe.error.StripeError as e:
+            # e.g. the intent already succeeded or was canceled
+            logger.warning("Could not update payment intent %s: %s", payment_intent_id, e)
+            return {
+                "success": False,
+                "error": str(e),
+                "clientSecret": None,
+                "paymentIntentId": None
+            }
+
+    async def _retrieve_payment_intent(self, payment_intent_id: str):
+        with span("stripe.PaymentIntent.retrieve", payment_intent_id=payment_intent_id):
+            return await self._call(stripe.PaymentIntent.retrieve, payment_intent_id)
+
+    async def _find_payment_intent(self, payment_intent_id: str):
+        """The PaymentIntent, or None if Stripe doesn't know it (deleted, or
+        created under another account or key)"""
+        try:
+            return await self._retrieve_payment_intent(payment_intent_id)
+        except stripe.error.InvalidRequestError as e:
+            if e.code == "resource_missing":
+                logger.warning("Payment intent %s no longer exists: %s", payment_intent_id, e)
+                return None
+            raise
+
+    @traced()
+    async def ensure_payment_intent(self, order: Order) -> dict:
+        """Reuse the order's PaymentIntent, updating its amount if needed,
+        and only create a new one when the previous intent was canceled
+        (or no longer exists).
+
+        The amount always comes from the order. The client secret cached on
+        the order is returned without calling Stripe while its amount still
+        matches; an intent that succeeded meanwhile is settled through
+        /payments/confirm or reconciliation, and a canceled one fails the
+        order in reconciliation, which clears the cache. Otherwise the
+        intent is retrieved first. Idempotency keys are derived from the
+        orderId (and the intent being replaced), so a retried request never
+        creates a second intent. Adds ``"outcome"`` to the result: reused,
+        updated, created, or paid when the existing intent already
+        succeeded (no new intent is created then).
+        """
+        payment = order.paymentInfo
+        amount = payment.amount
+        amount_cents = to_cents(amount)
+        previous_id = payment.paymentIntentId
+
+        if previous_id and payment.clientSecret and payment.intentAmountCents == amount_cents:
+            payment_intents_counter.inc(outcome="reused")
+            return {
+                "success": True,
+                "clientSecret": payment.clientSecret,
+                "paymentIntentId": previous_id,
+                "amount": amount,
+                "outcome": "reused"
+            }
+
+        try:
+            intent = await self._find_payment_intent(previous_id) if previous_id else None
+            if intent is not None and intent.status != "canceled":
+                if intent.status == "succeeded":
+                    return self._intent_result(intent, amount, "paid")
+                if intent.amount == amount_cents:
+                    return self._intent_result(intent, amount, "reused")
+
+                result = await self.update_payment_intent_amount(
+                    previous_id, amount,
+                    idempotency_key=f"order-{order.orderId}-{previous_id}-amount-{amount_cents}"
+                )
+                if result["success"]:
+                    payment_intents_counter.inc(outcome="updated")
+                    return {**result, "outcome": "updated"}
+
+                # The intent changed state under us; only a canceled one may be replaced
+                intent = await self._find_payment_intent(previous_id)
+                if intent is not None:
+                    if intent.status == "succeeded":
+                        return self._intent_result(intent, amount, "paid")
+                    if intent.status != "canceled":
+                        return {**result, "outcome": "updated"}
+        except ServiceUnavailableError:
+            raise
+        except stripe.error.StripeError as e:
+            logger.error("Stripe error retrieving payment intent %s: %s", previous_id, e)
+            return {
+                "success": False,
+                "error": str(e),
+                "clientSecret": None,
+                "paymentIntentId": None,
+                "outcome": None
+            }
+
+        result = await self.create_payment_intent(
+            amount=amount,
+            order_id=order.orderId,
+            customer_email=order.customer.email,
+            idempotency_key=f"order-{order.orderId}-{previous_id or 'initial'}-create-{amount_cents}"
+        )
+        if result["success"]:
+            payment_intents_counter.inc(outcome="created")
+        return {**result, "outcome": "created"}
+
+    def _intent_result(self, intent, amount: float, outcome: str) -> dict:
+        payment_intents_counter.inc(outcome=outcome)
+        return {
+            "success": True,
+            "clientSecret": intent.client_secret,
+            "paymentIntentId": intent.id,
+            "amount": amount,
+            "outcome": outcome
+        }
+
+    @traced()
     async def confirm_payment(self, payment_intent_id: str) -> dict:
         """Confirm payment status with Stripe"""
         try:
-            payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+            payment_intent = await self._retrieve_payment_intent(payment_intent_id)
             
             return {
                 "success": True,
@@ -67,29 +283,54 @@ class StripeService:
                 "metadata": payment_intent.metadata
             }
             
+        except ServiceUnavailableError:
+            raise
         except stripe.error.StripeError as e:
-            logger.error(f"Stripe error confirming payment: {e}")
+            logger.error("Stripe error confirming payment: %s", e)
             return {
                 "success": False,
                 "error": str(e),
                 "status": None
             }
         except Exception as e:
-            logger.error(f"Unexpected error confirming payment: {e}")
+            logger.error("Unexpected error confirming payment: %s", e)
             return {
                 "success": False,
                 "error": "Error interno del servidor",
                 "status": None
             }
 
+    async def list_payment_intents(self, created_from: datetime, created_to: datetime,
+                                   page_size: int = 100) -> AsyncIterator[List[stripe.PaymentIntent]]:
+        """PaymentIntents created in [created_from, created_to), a page at a time"""
+        created = {
+            "gte": int(created_from.replace(tzinfo=timezone.utc).timestamp()),
+            "lt": int(created_to.replace(tzinfo=timezone.utc).timestamp())
+        }
+        starting_after = None
+        while True:
+            params = {"created": created, "limit": page_size}
+            if starting_after:
+                params["starting_after"] = starting_after
+            with span("stripe.PaymentIntent.list", page_size=page_size):
+                page = await self._call(stripe.PaymentIntent.list, **params)
+            if page.data:
+                yield page.data
+            if not page.has_more or not page.data:
+                return
+            starting_after = page.data[-1].id
+
+    @traced()
     async def create_customer(self, email: str, name: str) -> Optional[dict]:
         """Create a Stripe customer"""
         try:
-            customer = stripe.Customer.create(
-                email=email,
-                name=name,
-                description=f"Cliente de ebooks: {name}"
-            )
+            with span("stripe.Customer.create"):
+                customer = await self._call(
+                    stripe.Customer.create,
+                    email=email,
+                    name=name,
+                    description=f"Cliente de ebooks: {name}"
+                )
             
             return {
                 "success": True,
@@ -97,14 +338,17 @@ class StripeService:
                 "email": customer.email
             }
             
+        except ServiceUnavailableError:
+            raise
         except stripe.error.StripeError as e:
-            logger.error(f"Stripe error creating customer: {e}")
+            logger.error("Stripe error creating customer: %s", e)
             return {
                 "success": False,
                 "error": str(e),
                 "customer_id": None
             }
 
+    @traced()
     async def handle_webhook(self, payload: str, signature: str) -> dict:
         """Handle Stripe webhook"""
         webhook_secret = os.getenv("STRIPE_WEBHOOK_SECRET")
@@ -114,9 +358,10 @@ class StripeService:
             return {"success": False, "error": "Webhook secret not configured"}
         
         try:
-            event = stripe.Webhook.construct_event(
-                payload, signature, webhook_secret
-            )
+            with span("stripe.Webhook.construct_event"):
+                event = stripe.Webhook.construct_event(
+                    payload, signature, webhook_secret
+                )
             
             # Handle the event
             if event['type'] == 'payment_intent.succeeded':
@@ -151,13 +396,13 @@ class StripeService:
                 }
                 
         except ValueError as e:
-            logger.error(f"Invalid payload: {e}")
+            logger.error("Invalid payload: %s", e)
             return {"success": False, "error": "Invalid payload"}
         except stripe.error.SignatureVerificationError as e:
-            logger.error(f"Invalid signature: {e}")
+            logger.error("Invalid signature: %s", e)
             return {"success": False, "error": "Invalid signature"}
         except Exception as e:
-            logger.error(f"Webhook error: {e}")
+            logger.error("Webhook error: %s", e)
             return {"success": False, "error": str(e)}
 
     def get_publishable_key(self) -> str:
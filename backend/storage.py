@@ -0,0 +1,139 @@
+import os
+import hmac
+import time
+import asyncio
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote, urlencode
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBackend(ABC):
+    """Where ebook files (and other binary assets) live.
+
+    Downloads are served by redirecting the client to a short-lived URL
+    issued by the backend, so file bytes never pass through the API process.
+    """
+
+    @abstractmethod
+    async def presigned_url(self, key: str, expires_in: int, filename: Optional[str] = None) -> str:
+        """Short-lived URL the client can GET the object from"""
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Whether an object is stored under ``key``"""
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        """Read a whole object (for small assets only)"""
+
+    @abstractmethod
+    async def put(self, key: str, data: bytes, content_type: Optional[str] = None):
+        """Store an object"""
+
+
+class S3StorageBackend(StorageBackend):
+    """S3-compatible storage (AWS S3, MinIO, moto) via boto3.
+
+    Configured with S3_BUCKET, and optionally S3_ENDPOINT_URL (for MinIO or
+    a moto server), S3_REGION and the standard AWS credential variables.
+    """
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None):
+        import boto3
+
+        self.bucket = bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+
+    async def presigned_url(self, key: str, expires_in: int, filename: Optional[str] = None) -> str:
+        params = {"Bucket": self.bucket, "Key": key}
+        if filename:
+            params["ResponseContentDisposition"] = f"attachment; filename=\"{filename}\""
+        # Presigning is a local HMAC computation, no network round trip
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    async def get(self, key: str) -> bytes:
+        response = await asyncio.to_thread(self.client.get_object, Bucket=self.bucket, Key=key)
+        return await asyncio.to_thread(response["Body"].read)
+
+    async def put(self, key: str, data: bytes, content_type: Optional[str] = None):
+        extra = {"ContentType": content_type} if content_type else {}
+        await asyncio.to_thread(self.client.put_object, Bucket=self.bucket, Key=key, Body=data, **extra)
+
+
+class LocalStorageBackend(StorageBackend):
+    """Files under a local directory, for development.
+
+    Presigned URLs point at /api/files/{key} with an HMAC signature and
+    expiry, which the API serves itself; use S3/MinIO in production.
+    """
+
+    def __init__(self, root: Path, secret: str, base_url: str = "/api/files"):
+        self.root = Path(root)
+        self.secret = secret.encode("utf-8")
+        self.base_url = base_url.rstrip("/")
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def _signature(self, key: str, expires: int) -> str:
+        message = f"{key}:{expires}".encode("utf-8")
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def verify(self, key: str, expires: int, signature: str) -> bool:
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(key, expires), signature)
+
+    async def presigned_url(self, key: str, expires_in: int, filename: Optional[str] = None) -> str:
+        expires = int(time.time()) + expires_in
+        query = {"expires": expires, "signature": self._signature(key, expires)}
+        if filename:
+            query["filename"] = filename
+        return f"{self.base_url}/{quote(key)}?{urlencode(query)}"
+
+    async def exists(self, key: str) -> bool:
+        return self.path_for(key).is_file()
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self.path_for(key).read_bytes)
+
+    async def put(self, key: str, data: bytes, content_type: Optional[str] = None):
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(path.write_bytes, data)
+
+
+def create_storage() -> StorageBackend:
+    """Build the backend selected by STORAGE_BACKEND (``local`` or ``s3``)"""
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "s3":
+        return S3StorageBackend(
+            bucket=os.environ["S3_BUCKET"],
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            region=os.getenv("S3_REGION")
+        )
+
+    secret = os.getenv("STORAGE_SIGNING_SECRET")
+    if not secret:
+        logger.warning("STORAGE_SIGNING_SECRET not set - using a random per-process secret")
+        secret = os.urandom(32).hex()
+    root = Path(os.getenv("LOCAL_STORAGE_DIR", Path(__file__).parent / "storage"))
+    return LocalStorageBackend(root, secret)
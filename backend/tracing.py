@@ -0,0 +1,119 @@
+import os
+import functools
+import logging
+from contextlib import contextmanager
+from typing import Optional
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from opentelemetry.instrumentation.pymongo import PymongoInstrumentor
+
+logger = logging.getLogger(__name__)
+
+# Module-level proxy tracer: it is safe to use before setup_tracing() runs and
+# turns into a no-op when tracing is disabled.
+tracer = trace.get_tracer("ebooks-api")
+
+_configured = False
+
+
+def _build_exporter(exporter_name: str):
+    """Create the span exporter selected by OTEL_TRACES_EXPORTER"""
+    if exporter_name == "otlp":
+        # Endpoint and headers come from the standard OTEL_EXPORTER_OTLP_* variables
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+
+    if exporter_name == "file":
+        path = os.getenv("OTEL_TRACES_FILE", "traces.jsonl")
+        out = open(path, "a", encoding="utf-8")
+        return ConsoleSpanExporter(
+            out=out,
+            formatter=lambda span: span.to_json(indent=None) + os.linesep
+        )
+
+    if exporter_name == "console":
+        return ConsoleSpanExporter()
+
+    return None
+
+
+def setup_tracing(app=None) -> bool:
+    """Configure the tracer provider and instrument FastAPI and MongoDB.
+
+    Tracing is opt-in: set OTEL_TRACES_EXPORTER to ``otlp`` (local collector),
+    ``file`` (JSON lines in OTEL_TRACES_FILE) or ``console``. Must run before
+    the Motor client is created so the PyMongo command listener is registered.
+    """
+    global _configured
+
+    exporter_name = os.getenv("OTEL_TRACES_EXPORTER", "none").lower()
+    exporter = _build_exporter(exporter_name)
+    if exporter is None:
+        return False
+
+    if not _configured:
+        resource = Resource.create({
+            "service.name": os.getenv("OTEL_SERVICE_NAME", "ebooks-api")
+        })
+        provider = TracerProvider(resource=resource)
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        PymongoInstrumentor().instrument()
+        _configured = True
+        logger.info("Tracing enabled with '%s' exporter", exporter_name)
+
+    if app is not None:
+        FastAPIInstrumentor.instrument_app(app)
+
+    return True
+
+
+def shutdown_tracing():
+    """Flush pending spans"""
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "shutdown"):
+        provider.shutdown()
+
+
+def traced(span_name: Optional[str] = None):
+    """Decorator that runs an async function inside a span named after it"""
+    def decorator(func):
+        name = span_name or func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Open a child span for a block of synchronous work"""
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+def install_log_correlation():
+    """Add trace_id and span_id attributes to every log record"""
+    previous_factory = logging.getLogRecordFactory()
+
+    def record_factory(*args, **kwargs):
+        record = previous_factory(*args, **kwargs)
+        context = trace.get_current_span().get_span_context()
+        if context.is_valid:
+            record.trace_id = format(context.trace_id, "032x")
+            record.span_id = format(context.span_id, "016x")
+        else:
+            record.trace_id = "0"
+            record.span_id = "0"
+        return record
+
+    logging.setLogRecordFactory(record_factory)
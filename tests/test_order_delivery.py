@@ -0,0 +1,87 @@
+"""Purchase flow through the API against an in-memory MongoDB.
+
+Runs the FastAPI app over httpx's ASGI transport with mongomock-motor in
+place of MongoDB and Stripe stubbed out, so it needs no services::
+
+    pytest tests/test_order_delivery.py
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from bson import ObjectId  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "ebooks_test")
+os.environ["DOWNLOAD_TOKEN_KEYS"] = "test:" + "x" * 48
+
+import database  # noqa: E402
+import server  # noqa: E402
+from events import bus  # noqa: E402
+
+CUSTOMER = {"email": "lectora@example.com", "firstName": "Lucía", "lastName": "Pérez", "country": "ES"}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    mock_db = mongomock_motor.AsyncMongoMockClient()["ebooks_test"]
+    monkeypatch.setattr(database.database, "database", mock_db)
+    return mock_db
+
+
+def test_confirm_delivers_order_queues_email_and_grants_entitlement(db, monkeypatch):
+    book_id = str(ObjectId())
+
+    async def confirm_payment(payment_intent_id):
+        return {"success": True, "status": "succeeded", "amount": 19.99,
+                "metadata": {"order_id": order_id}}
+
+    monkeypatch.setattr(server.stripe_service, "confirm_payment", confirm_payment)
+
+    async def scenario():
+        nonlocal order_id
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/api/orders", json={
+                "items": [{"bookId": book_id, "price": 19.99, "title": "Supera tus Miedos"}],
+                "customer": CUSTOMER
+            })
+            assert response.status_code == 200, response.text
+            order_id = response.json()["orderId"]
+
+            response = await client.post("/api/payments/confirm", json={
+                "paymentIntentId": "pi_test", "orderId": order_id
+            })
+            assert response.status_code == 200, response.text
+            assert [link["bookId"] for link in response.json()["downloadLinks"]] == [book_id]
+
+            # Entitlements are granted by a background event handler
+            await bus.drain()
+
+            order = await db.orders.find_one({"orderId": order_id})
+            assert order["status"] == "delivered"
+
+            email = await db.email_outbox.find_one({"_id": f"order-delivered:{order_id}"})
+            assert email is not None
+            assert email["to"] == CUSTOMER["email"]
+            assert email["status"] == "pending"
+
+            entitlement = await db.entitlements.find_one({"email": CUSTOMER["email"], "bookId": book_id})
+            assert entitlement is not None
+            assert entitlement["orderIds"] == [order_id]
+
+            response = await client.post("/api/library", json={
+                "email": CUSTOMER["email"], "orderId": order_id
+            })
+            assert response.status_code == 200, response.text
+            assert [book["bookId"] for book in response.json()["books"]] == [book_id]
+
+    order_id = None
+    asyncio.run(scenario())